@@ -0,0 +1,83 @@
+"""
+AsyncController against a stubbed slow backend (each call sleeps DELAY seconds, as a slow share or database).
+
+Shows how long the caller is blocked per call, how many backend calls are made when the same request is sent
+repeatedly (coalescing) and how cancellation and timeouts behave.
+
+Run with: python benchmarks/async_controller.py
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pre_system_svea.async_controller import AsyncController
+
+DELAY = 0.5
+NUMBER = 50
+
+
+class SlowBackend:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _slow(self, result):
+        with self._lock:
+            self.calls += 1
+        time.sleep(DELAY)
+        return result
+
+    def get_next_serno(self, **kwargs):
+        return self._slow('0042')
+
+    def series_exists(self, **kwargs):
+        return self._slow(False)
+
+    def get_svepa_info(self, credentials_path):
+        return self._slow(dict(station='BY5 BORNHOLMSDJ'))
+
+
+def main():
+    backend = SlowBackend()
+    async_controller = AsyncController(backend, max_workers=4)
+
+    t0 = time.perf_counter()
+    futures = [async_controller.get_next_serno(year=2024, ship='77SE', cruise='01') for _ in range(NUMBER)]
+    submit_time = time.perf_counter() - t0
+    results = {future.result() for future in futures}
+    total_time = time.perf_counter() - t0
+    print(f'{NUMBER} identical get_next_serno calls')
+    print(f'  caller blocked per call: {submit_time / NUMBER * 1e6:.1f} us')
+    print(f'  backend calls: {backend.calls}, results: {results}, done after {total_time:.2f} s '
+          f'(synchronous: {NUMBER * DELAY:.1f} s)')
+
+    backend.calls = 0
+    futures = [async_controller.series_exists(serno=str(i).zfill(4)) for i in range(8)]
+    t0 = time.perf_counter()
+    for future in futures:
+        future.result()
+    print(f'8 different series_exists calls on 4 workers: {time.perf_counter() - t0:.2f} s, '
+          f'{backend.calls} backend calls')
+
+    backend.calls = 0
+    blocking = [async_controller.series_exists(serno=f'b{i}') for i in range(4)]
+    queued = async_controller.get_svepa_info('credentials.yaml')
+    queued.cancel()
+    timed_out = async_controller.get_svepa_info('other.yaml', timeout=0.1)
+    try:
+        timed_out.result()
+    except TimeoutError as e:
+        print(f'timeout: {e}')
+    for future in blocking:
+        future.result()
+    time.sleep(2 * DELAY)
+    print(f'cancelled while queued: {queued.cancelled()}, backend calls: {backend.calls} (only the 4 blocking: '
+          f'the cancelled and the timed out calls were dropped from the queue)')
+    async_controller.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Throughput of the coordinate conversions in pre_system_svea.coordinates on million element arrays,
+compared with the element by element loop the conversions used to be.
+
+Run with: python benchmarks/coordinates.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pre_system_svea import coordinates
+
+SIZE = 1_000_000
+
+
+def loop_decmin_to_decdeg(pos):
+    output = []
+    for p in pos:
+        p = float(p)
+        if p >= 0:
+            output.append(np.floor(p / 100.) + (p % 100) / 60.)
+        else:
+            output.append(np.ceil(p / 100.) - (-p % 100) / 60.)
+    return output
+
+
+def loop_decdeg_to_decmin(pos):
+    output = []
+    for p in pos:
+        p = float(p)
+        deg = np.floor(p)
+        minut = p % deg * 60.0
+        output.append(deg * 100.0 + minut)
+    return output
+
+
+def timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def report(label, seconds):
+    print(f'{label:<40} {seconds * 1000:10.1f} ms {SIZE / seconds / 1e6:10.2f} M positions/s')
+
+
+def main():
+    rng = np.random.default_rng(0)
+    decmin = np.round(rng.uniform(-17959.99, 17959.99, SIZE), 2)
+    decmin = np.sign(decmin) * (np.floor(np.abs(decmin) / 100) * 100 + np.abs(decmin) % 60)
+    decdeg = rng.uniform(1, 179, SIZE)
+    text = decmin.astype(str)
+
+    report('decmin_to_decdeg, loop', timed(loop_decmin_to_decdeg, decmin))
+    report('decmin_to_decdeg, vectorized', timed(coordinates.decmin_to_decdeg, decmin))
+    report('decmin_to_decdeg, vectorized, str input', timed(coordinates.decmin_to_decdeg, text))
+    report('decdeg_to_decmin, loop', timed(loop_decdeg_to_decmin, decdeg))
+    report('decdeg_to_decmin, vectorized', timed(coordinates.decdeg_to_decmin, decdeg))
+
+    back = coordinates.decdeg_to_decmin(coordinates.decmin_to_decdeg(decmin))
+    print(f'Max round trip error: {np.max(np.abs(back - decmin)):.2e} minutes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Import time regression check for pre_system_svea.controller.
+
+Runs "python -X importtime -c 'import <module>'" in a fresh interpreter, prints the slowest imports
+(cumulative, like -X importtime) and fails if any of the heavy dependencies are loaded at import time.
+These should only be imported when the feature that needs them is used.
+
+Run with: python benchmarks/import_time.py [module]
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+# The module is imported from this checkout also when pre_system_svea is not installed
+ROOT_DIRECTORY = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ['pandas', 'numpy', 'requests', 'psutil', 'svepa', 'file_explorer']
+NR_SLOWEST = 15
+
+
+def get_import_times(module):
+    """Returns a list of (cumulative_us, self_us, module_name) from -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True, cwd=ROOT_DIRECTORY)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        times.append((int(parts[1]), int(parts[0]), parts[2].strip()))
+    return times
+
+
+def main(module='pre_system_svea.controller'):
+    times = get_import_times(module)
+    total = max(cumulative for cumulative, _, _ in times)
+    print(f'Importing {module}: {total / 1000:.1f} ms')
+    print(f'{"cumulative [us]":>16} {"self [us]":>10}  module')
+    for cumulative, self_time, name in sorted(times, reverse=True)[:NR_SLOWEST]:
+        print(f'{cumulative:>16} {self_time:>10}  {name}')
+
+    loaded = {name.split('.')[0] for _, _, name in times}
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+    if heavy:
+        print(f'FAIL: heavy modules imported at import time: {", ".join(heavy)}')
+        return 1
+    print('OK: no heavy modules imported at import time')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
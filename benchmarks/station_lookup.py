@@ -0,0 +1,52 @@
+"""
+Per call latency of station name lookups.
+
+"before" is the boolean mask lookup that StationFile.get_station_info used to do:
+    df.loc[df['STATION_NAME'] == name].iloc[0].to_dict()
+on the station list DataFrame (read here, the station data no longer keeps it).
+"after" is the current StationFile.get_station_info using the name and synonym indexes built at load time.
+
+Run with: python benchmarks/station_lookup.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pre_system_svea.station import StationFile
+from pre_system_svea.resource import get_resources
+
+NUMBER = 2000
+
+
+def mask_lookup(station_file, df, name):
+    proper_name = station_file.get_proper_station_name(name)
+    return df.loc[df['STATION_NAME'] == proper_name].iloc[0].to_dict()
+
+
+def report(label, seconds):
+    print(f'{label:<45} {seconds / NUMBER * 1e6:10.1f} us/call')
+
+
+def main():
+    resources = get_resources()
+    station_file = StationFile(backup_file_path=resources.backup_station_file,
+                               primary_url=resources.primary_station_file_url)
+    df = pd.read_csv(resources.backup_station_file, sep='\t', encoding=resources.backup_station_file_encoding)
+    names = ['BY5 BORNHOLMSDJ', 'by5', 'SLÄGGÖ', 'N7 OST NIDINGEN']
+    for name in names:
+        before = timeit.timeit(lambda: mask_lookup(station_file, df, name), number=NUMBER)
+        after = timeit.timeit(lambda: station_file.get_station_info(name), number=NUMBER)
+        print(name)
+        report('  before: get_station_info (mask + to_dict)', before)
+        report('  after:  get_station_info (index)', after)
+        report('  after:  get_position', timeit.timeit(lambda: station_file.get_position(name), number=NUMBER))
+        report('  after:  get_distance_to_station',
+               timeit.timeit(lambda: station_file.get_distance_to_station(5718.2, 1159.3, name), number=NUMBER))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Memory and allocations of the station data.
+
+"before" is the DataFrame plus one dict per row (df.to_dict('records')) that the station data used to hold,
+with a new dict copy (and the lat/lon/depth/station keys added) for every get_station_info/get_closest_station.
+"after" is the column store (pre_system_svea.station_store) with read only StationRecord views.
+
+Memory is measured with tracemalloc:
+- station data: memory held by the loaded structure
+- per call: memory allocated per lookup when the results are kept (as the GUI does between updates)
+
+Run with: python benchmarks/station_memory.py
+"""
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pre_system_svea.station import StationFile
+from pre_system_svea.station_store import StationStore
+from pre_system_svea.resource import get_resources
+
+NUMBER = 10000
+
+
+def read_df(station_file):
+    file_path, encoding = station_file._get_file_path_and_encoding()
+    df = pd.read_csv(file_path, sep='\t', encoding=encoding)
+    df['MEDIA'] = df['MEDIA'].fillna('')
+    df['WADEP'] = df['WADEP'].fillna('')
+    return df
+
+
+def traced(func):
+    """Returns the result of func and the memory (bytes) allocated by it that is still held."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+def dict_lookup(records, row):
+    station_info = dict(records[row])
+    station_info['lat'] = station_info['LAT_DM']
+    station_info['lon'] = station_info['LONG_DM']
+    station_info['depth'] = str(station_info['WADEP'])
+    station_info['station'] = station_info['STATION_NAME']
+    return station_info
+
+
+def report(label, value, unit):
+    print(f'{label:<55} {value:12.1f} {unit}')
+
+
+def main():
+    resources = get_resources()
+    station_file = StationFile(backup_file_path=resources.backup_station_file,
+                               primary_url=resources.primary_station_file_url)
+    rows = [station_file.station_data.station_rows[name] for name in ['BY5 BORNHOLMSDJ', 'SLÄGGÖ',
+                                                                      'N7 OST NIDINGEN']]
+
+    (df, records), before = traced(lambda: (lambda df: (df, df.to_dict('records')))(read_df(station_file)))
+    store, after = traced(lambda: StationStore(read_df(station_file)))
+    print(f'Station data ({len(records)} stations)')
+    report('  before: DataFrame + list of row dicts', before / 1024, 'kB')
+    report('  after:  StationStore', after / 1024, 'kB')
+
+    _, before = traced(lambda: [dict_lookup(records, rows[i % 3]) for i in range(NUMBER)])
+    _, after = traced(lambda: [store.record(rows[i % 3]) for i in range(NUMBER)])
+    _, after_distance = traced(lambda: [store.record(rows[i % 3], distance=100, acceptable=True)
+                                        for i in range(NUMBER)])
+    print(f'Allocated per lookup ({NUMBER} results kept)')
+    report('  before: dict copy', before / NUMBER, 'bytes')
+    report('  after:  StationRecord', after / NUMBER, 'bytes')
+    report('  after:  StationRecord with distance/acceptable', after_distance / NUMBER, 'bytes')
+
+    print('Time per lookup')
+    report('  before: dict copy', timeit.timeit(lambda: dict_lookup(records, rows[0]), number=NUMBER) / NUMBER * 1e6,
+           'us')
+    report('  after:  StationRecord', timeit.timeit(lambda: store.record(rows[0]), number=NUMBER) / NUMBER * 1e6,
+           'us')
+    record = store.record(rows[0])
+    report('  after:  StationRecord["lat"]', timeit.timeit(lambda: record['lat'], number=NUMBER) / NUMBER * 1e6,
+           'us')
+    report('  after:  StationRecord.to_dict()', timeit.timeit(record.to_dict, number=NUMBER) / NUMBER * 1e6, 'us')
+    report('  after:  get_station_info', timeit.timeit(lambda: station_file.get_station_info('by5'),
+                                                       number=NUMBER) / NUMBER * 1e6, 'us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+"""
+Micro-benchmark suite for the pre-system hot paths.
+
+Each case is timed with timeit (number of calls chosen with autorange, best of --repeat) and the results are
+saved as JSON in benchmarks/results/<name>.json. Give --compare with an earlier result file (or name) to list
+the cases that got slower than --threshold times the earlier median.
+
+The station list download, Seasave (subprocess) and SVEPA are stubbed so the suite runs offline on Linux.
+Cases that need file_explorer (PSA update and raw data directories) are skipped if it is not installed. The PSA
+case runs against a minimal ctd_config (Seasave.psa and one XMLCON file) written to a temporary directory. Give
+--ctd-config to run it against a copy of a real ctd_config directory instead.
+
+Run with: python benchmarks/suite.py [--name NAME] [--compare NAME] [--ctd-config DIR] [--quick]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+RESULTS_DIRECTORY = Path(Path(__file__).parent, 'results')
+PACKAGE_COUNTS = [10, 1000, 10000]
+
+CASES = []
+
+
+def case(name, requires=None):
+    """Registers a benchmark case. The decorated function takes the suite context and returns the callable to time."""
+    def decorator(func):
+        CASES.append((name, func, requires))
+        return func
+    return decorator
+
+
+class _FakeProcess:
+    pid = 0
+
+    def __init__(self, *args, **kwargs):
+        self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+def stub_external():
+    """Replaces the station list download, Seasave process and SVEPA with offline stubs."""
+    from pre_system_svea import download
+    from pre_system_svea import seasave
+
+    download.download_file = lambda *args, **kwargs: False
+    seasave.subprocess = types.SimpleNamespace(Popen=_FakeProcess)
+    seasave.SeasaveSupervisor._external_instance_running = lambda self, max_age=None: False
+    svepa = types.ModuleType('svepa')
+    svepa.get_current_station_info = lambda **kwargs: dict(station='BY5 BORNHOLMSDJ', lat='5515.0',
+                                                           lon='1559.0')
+    sys.modules['svepa'] = svepa
+
+
+def has_file_explorer():
+    try:
+        import file_explorer  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class BenchmarkPaths:
+    """Minimal stand in for file_explorer.seabird.paths.SBEPaths with all directories below root."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.config_dir = None
+
+    def __call__(self, key):
+        if key == 'config_dir':
+            return self.config_dir
+        return Path(self.root, key)
+
+    def set_config_root_directory(self, directory):
+        self.config_dir = Path(directory)
+
+    def _directory(self, location, key, year=None, create=False, **kwargs):
+        parts = [self.root, location, key]
+        if year:
+            parts.append(str(year))
+        directory = Path(*parts)
+        if create:
+            directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def get_local_directory(self, key, year=None, create=False, **kwargs):
+        return self._directory('local', key, year=year, create=create)
+
+    def get_server_directory(self, key, year=None, create=False, **kwargs):
+        return self._directory('server', key, year=year, create=create)
+
+
+def create_raw_directory(directory, nr_packages, year=2020):
+    """Creates empty .hex and .hdr files for nr_packages packages named as in Controller.get_data_file_path."""
+    directory.mkdir(parents=True, exist_ok=True)
+    start = datetime.datetime(year, 1, 1)
+    for i in range(nr_packages):
+        time_str = (start + datetime.timedelta(minutes=30 * i)).strftime('%Y%m%d_%H%M')
+        cruise = str(i // 9999 + 1).zfill(2)
+        serno = str(i % 9999 + 1).zfill(4)
+        stem = f'sbe09_1387_{time_str}_77SE_{cruise}_{serno}'
+        for suffix in ['.hex', '.hdr']:
+            Path(directory, stem + suffix).touch()
+
+
+PSA_FIXTURE = """<?xml version="1.0" encoding="UTF-8"?>
+<SeasaveProgramSetup version="Seasave V 7.26.7.107" >
+  <ProgramSetupFilePath value="{psa_path}" />
+  <ConfigurationFilePath value="{xmlcon_path}" />
+  <DataFilePath value="" />
+  <Settings>
+    <ArchiveData value="1" />
+    <PromptForDataFileName value="0" />
+    <MarkVariables value="" />
+    <WaterSamplerConfiguration>
+      <Type value="0" />
+      <NumberOfBottles value="24" />
+      <FiringSequence value="0" />
+    </WaterSamplerConfiguration>
+  </Settings>
+  <HeaderForm>
+    <Prompts>
+      <Prompt index="0" value="Ship:" />
+      <Prompt index="1" value="Cruise:" />
+      <Prompt index="2" value="Station:" />
+      <Prompt index="3" value="Operator:" />
+      <Prompt index="4" value="Latitude [GG MM.mm N]:" />
+      <Prompt index="5" value="Longitude [GGG MM.mm E]:" />
+      <Prompt index="6" value="Pumps:" />
+      <Prompt index="7" value="EventIDs:" />
+      <Prompt index="8" value="AdditionalSamplings:" />
+      <Prompt index="9" value="Metadata admin:" />
+      <Prompt index="10" value="Metadata conditions:" />
+      <Prompt index="11" value="LIMS Job:" />
+    </Prompts>
+  </HeaderForm>
+  <Displays>
+    <Display index="0" type="XYPlot" >
+      <XYPlotData>
+        <Axes>
+          <Axis index="0" Calc="Pressure" MinimumValue="0" MaximumValue="100" />
+          <Axis index="1" Calc="Temperature" MinimumValue="0" MaximumValue="25" />
+        </Axes>
+      </XYPlotData>
+    </Display>
+  </Displays>
+</SeasaveProgramSetup>
+"""
+
+XMLCON_FIXTURE = """<?xml version="1.0" encoding="UTF-8"?>
+<SBE_InstrumentConfiguration SB_ConfigCTD_FileVersion="7.26.7.0" >
+  <Instrument>
+    <Name>SBE 911plus/917plus CTD</Name>
+    <FrequencyChannelsSuppressed>0</FrequencyChannelsSuppressed>
+    <VoltageWordsSuppressed>0</VoltageWordsSuppressed>
+    <ComputerInterface>0</ComputerInterface>
+    <ScansToAverage>1</ScansToAverage>
+    <SurfaceParVoltageAdded>0</SurfaceParVoltageAdded>
+    <ScanTimeAdded>1</ScanTimeAdded>
+    <NmeaPositionDataAdded>1</NmeaPositionDataAdded>
+    <NmeaDepthDataAdded>0</NmeaDepthDataAdded>
+    <NmeaTimeAdded>1</NmeaTimeAdded>
+    <NmeaDeviceConnectedToPC>0</NmeaDeviceConnectedToPC>
+    <SensorArray Size="3" >
+      <Sensor index="0" SensorID="55" >
+        <TemperatureSensor SensorID="55" >
+          <SerialNumber>5678</SerialNumber>
+          <CalibrationDate>01-Jan-20</CalibrationDate>
+        </TemperatureSensor>
+      </Sensor>
+      <Sensor index="1" SensorID="3" >
+        <ConductivitySensor SensorID="3" >
+          <SerialNumber>4321</SerialNumber>
+          <CalibrationDate>01-Jan-20</CalibrationDate>
+        </ConductivitySensor>
+      </Sensor>
+      <Sensor index="2" SensorID="45" >
+        <PressureSensor SensorID="45" >
+          <SerialNumber>{serial_number}</SerialNumber>
+          <CalibrationDate>01-Jan-20</CalibrationDate>
+        </PressureSensor>
+      </Sensor>
+    </SensorArray>
+  </Instrument>
+</SBE_InstrumentConfiguration>
+"""
+
+
+def create_ctd_config(directory, instrument='sbe09', serial_number='1387'):
+    """
+    Writes a minimal ctd_config directory (the paths in resources/ctd_config.yaml): a Seasave.psa and one
+    instrument directory with an XMLCON file.
+    """
+    psa_path = Path(directory, 'SBE', 'seasave_psa', 'svea', 'Seasave.psa')
+    xmlcon_path = Path(directory, 'SBE', 'XMLCON', instrument, f'{instrument.upper()}_{serial_number}.XMLCON')
+    for path in [psa_path, xmlcon_path]:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    xmlcon_path.write_text(XMLCON_FIXTURE.format(serial_number=serial_number), encoding='utf-8')
+    psa_path.write_text(PSA_FIXTURE.format(psa_path=psa_path, xmlcon_path=xmlcon_path), encoding='utf-8')
+    return Path(directory)
+
+
+class Context:
+    def __init__(self, temp_directory, ctd_config=None):
+        self.temp_directory = Path(temp_directory)
+        self.ctd_config = ctd_config
+        self._stations = None
+
+    @property
+    def stations(self):
+        if self._stations is None:
+            from pre_system_svea.station import Stations
+            self._stations = Stations(update_primary=False)
+        return self._stations
+
+    def controller(self, name='controller'):
+        from pre_system_svea.controller import Controller
+        return Controller(BenchmarkPaths(Path(self.temp_directory, name)), update_primary_station_list=False)
+
+
+@case('controller: construction')
+def bench_controller(ctx):
+    return lambda: ctx.controller()
+
+
+@case('stations: Stations() load')
+def bench_stations_load(ctx):
+    from pre_system_svea.station import Stations
+    return lambda: Stations(update_primary=False)
+
+
+@case('stations: get_closest_station')
+def bench_closest_station(ctx):
+    stations = ctx.stations
+    return lambda: stations.get_closest_station(5718.1, 1159.2)
+
+
+@case('stations: get_station_info')
+def bench_station_info(ctx):
+    stations = ctx.stations
+    return lambda: stations.get_station_info('BY5 BORNHOLMSDJ')
+
+
+@case('stations: get_proper_station_name')
+def bench_proper_station_name(ctx):
+    stations = ctx.stations
+    return lambda: stations.get_proper_station_name('by5')
+
+
+@case('ships: get_code')
+def bench_ship_code(ctx):
+    from pre_system_svea.ship import Ships
+    ships = Ships()
+    return lambda: ships.get_code('77SE')
+
+
+@case('svepa: get_svepa_info (stub)')
+def bench_svepa_info(ctx):
+    controller = ctx.controller()
+    return lambda: controller.get_svepa_info('credentials.yaml')
+
+
+@case('controller: update_main_psa_file', requires='file_explorer')
+def bench_update_main_psa_file(ctx):
+    config_directory = Path(ctx.temp_directory, 'ctd_config')
+    if ctx.ctd_config:
+        shutil.copytree(ctx.ctd_config, config_directory)
+    else:
+        create_ctd_config(config_directory)
+    controller = ctx.controller('psa')
+    controller.ctd_config_root_directory = config_directory
+    instrument = sorted(controller.ctd_config.seasave_xmlcon_files)[0]
+    counter = iter(range(1, 10 ** 6))
+
+    def func():
+        controller.update_main_psa_file(instrument=instrument, cruise_nr='01', ship_code='77SE',
+                                        serno=str(next(counter)).zfill(4), station='BY5 BORNHOLMSDJ',
+                                        operator='MW', position=['5515.0', '1559.0'])
+    return func
+
+
+def _package_controller(ctx, nr_packages):
+    controller = ctx.controller(f'packages_{nr_packages}')
+    directory = controller._get_raw_data_path(year=2020, create=True)
+    create_raw_directory(directory, nr_packages)
+    # As a directory written earlier, not within the mtime resolution where it is listed on every check
+    old_time = time.time() - 60
+    os.utime(directory, (old_time, old_time))
+    return controller
+
+
+for _nr_packages in PACKAGE_COUNTS:
+    @case(f'packages[{_nr_packages}]: first series_exists (index build)', requires='file_explorer')
+    def bench_package_index_build(ctx, nr_packages=_nr_packages):
+        controller = _package_controller(ctx, nr_packages)
+
+        def func():
+            controller.close()
+            controller.series_exists(year=2020, ship='77SE', cruise='01', serno='0005')
+        return func
+
+    @case(f'packages[{_nr_packages}]: series_exists', requires='file_explorer')
+    def bench_series_exists(ctx, nr_packages=_nr_packages):
+        controller = _package_controller(ctx, nr_packages)
+        return lambda: controller.series_exists(year=2020, ship='77SE', cruise='01', serno='0005')
+
+    @case(f'packages[{_nr_packages}]: get_next_serno (serno ledger)')
+    def bench_next_serno(ctx, nr_packages=_nr_packages):
+        controller = _package_controller(ctx, nr_packages)
+        return lambda: controller.get_next_serno(year=2020, ship='77SE', cruise='01')
+
+    @case(f'packages[{_nr_packages}]: reserve_serno (serno ledger)')
+    def bench_reserve_serno(ctx, nr_packages=_nr_packages):
+        controller = _package_controller(ctx, nr_packages)
+
+        def func():
+            controller.reserve_serno(year=2020, ship='77SE', cruise='01')
+            controller.release_serno(year=2020, ship='77SE', cruise='01')
+        return func
+
+
+def measure(func, repeat=5, min_time=0.2):
+    func()
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        seconds = timer.timeit(number)
+        if seconds >= min_time or number >= 10 ** 6:
+            break
+        number *= 10 if seconds < min_time / 10 else 2
+    per_call = [timer.timeit(number) / number for _ in range(repeat)]
+    return dict(number=number,
+                repeat=repeat,
+                min=min(per_call),
+                median=statistics.median(per_call),
+                mean=statistics.mean(per_call),
+                stdev=statistics.stdev(per_call) if repeat > 1 else 0.)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(ctd_config=None, repeat=5, min_time=0.2, select=None):
+    stub_external()
+    available = dict(file_explorer=has_file_explorer())
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='pre_system_benchmark_') as temp_directory:
+        ctx = Context(temp_directory, ctd_config=ctd_config)
+        for name, setup, requires in CASES:
+            if select and select not in name:
+                continue
+            if requires and not available[requires]:
+                print(f'{name:<55} skipped (requires {requires})')
+                continue
+            result = measure(setup(ctx), repeat=repeat, min_time=min_time)
+            results[name] = result
+            print(f'{name:<55} {result["median"] * 1e6:12.1f} us/call (min {result["min"] * 1e6:.1f})')
+    return results
+
+
+def get_result_path(name):
+    path = Path(name)
+    if path.suffix == '.json' and path.exists():
+        return path
+    return Path(RESULTS_DIRECTORY, f'{name}.json')
+
+
+def save(results, name):
+    RESULTS_DIRECTORY.mkdir(exist_ok=True)
+    data = dict(name=name,
+                created=datetime.datetime.now().isoformat(timespec='seconds'),
+                git_commit=get_git_commit(),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                results=results)
+    path = get_result_path(name)
+    with open(path, 'w') as fid:
+        json.dump(data, fid, indent=2)
+    print(f'Results saved to {path}')
+
+
+def compare(results, name, threshold):
+    """Prints the change in median per case compared with an earlier result. Returns the names of regressions."""
+    with open(get_result_path(name)) as fid:
+        earlier = json.load(fid)['results']
+    regressions = []
+    print(f'\nCompared with {name}:')
+    for case_name, result in results.items():
+        if case_name not in earlier:
+            continue
+        ratio = result['median'] / earlier[case_name]['median']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(case_name)
+        print(f'{case_name:<55} {ratio:6.2f}x{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--name', default=datetime.datetime.now().strftime('%Y%m%d_%H%M%S'),
+                        help='name of the result file in benchmarks/results')
+    parser.add_argument('--compare', help='earlier result (name or path) to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown (ratio of medians) reported as a regression')
+    parser.add_argument('--ctd-config',
+                        help='ctd_config directory copied for the PSA case. A minimal one is generated if not given')
+    parser.add_argument('--select', help='only run cases with this text in the name')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='shorter timings (less accurate)')
+    args = parser.parse_args()
+
+    results = run(ctd_config=args.ctd_config, repeat=args.repeat, min_time=0.05 if args.quick else 0.2,
+                  select=args.select)
+    save(results, args.name)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Future based facade over Controller so that a GUI never waits on I/O.
+
+    async_controller = AsyncController(controller)
+    future = async_controller.get_next_serno(year=2024, timeout=5)
+    future.add_done_callback(on_serno)   # called from a worker thread
+    ...
+    serno = await asyncio.wrap_future(async_controller.series_exists(...))   # from asyncio code
+
+Calls run on a bounded thread pool and each caller gets its own concurrent.futures.Future:
+- Read calls with the same arguments that are already in flight are coalesced: all callers get the result of
+  the single call that is running.
+- A future can be cancelled. The call itself is cancelled when no caller is waiting for it any more and it has
+  not started yet. A call that has started always runs to completion, but its result is ignored.
+- With a timeout the future fails with TimeoutError if the call has not finished in time.
+- Calls that write (update_main_psa_file) are never coalesced and run one at a time. Serno reservations are
+  never coalesced (they are serialized by the serno ledger).
+"""
+import concurrent.futures
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(_freeze(item) for item in value)
+    return value
+
+
+def _get_key(name, args, kwargs):
+    """Returns a hashable key for the call, or None if the arguments are not hashable."""
+    key = (name, _freeze(args), _freeze(kwargs))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class _Call:
+    """One call running (or queued) on the executor and the caller futures waiting for it."""
+
+    def __init__(self):
+        self.future = None
+        self.waiters = set()
+        self.lock = threading.Lock()
+
+    def add_waiter(self, waiter):
+        with self.lock:
+            self.waiters.add(waiter)
+
+    def remove_waiter(self, waiter):
+        """
+        Removes waiter. Returns (removed, empty). removed is False if the waiter has already been taken for
+        delivery of the result, empty is True if no waiters are left.
+        """
+        with self.lock:
+            if waiter not in self.waiters:
+                return False, False
+            self.waiters.discard(waiter)
+            return True, not self.waiters
+
+    def deliver(self, future):
+        with self.lock:
+            waiters, self.waiters = self.waiters, set()
+        for waiter in waiters:
+            if not waiter.set_running_or_notify_cancel():
+                continue
+            if future.cancelled():
+                waiter.set_exception(concurrent.futures.CancelledError())
+            elif future.exception() is not None:
+                waiter.set_exception(future.exception())
+            else:
+                waiter.set_result(future.result())
+
+
+def _future_method(name, coalesce=True, exclusive=False):
+    def method(self, *args, timeout=None, **kwargs):
+        return self.submit(name, *args, timeout=timeout, coalesce=coalesce, exclusive=exclusive, **kwargs)
+    method.__name__ = name
+    method.__doc__ = f'Runs Controller.{name} in the background. Returns a concurrent.futures.Future.'
+    return method
+
+
+class AsyncController:
+    """
+    Runs Controller methods on a bounded thread pool and returns futures. See the module docstring.
+    """
+
+    def __init__(self, controller, max_workers=4, default_timeout=None):
+        """
+        :param controller: Controller (or any object with the same methods, e.g. a stub in tests)
+        :param max_workers: max number of calls running at the same time
+        :param default_timeout: timeout in seconds used when none is given in the call. None for no timeout.
+        """
+        self.controller = controller
+        self.default_timeout = default_timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='async_controller')
+        # Reentrant since future callbacks may run directly in submit/cancel while the lock is held
+        self._lock = threading.RLock()
+        self._in_flight = {}
+        self._exclusive_lock = threading.Lock()
+
+    def submit(self, name, *args, timeout=None, coalesce=True, exclusive=False, **kwargs):
+        """
+        Runs controller.<name>(*args, **kwargs) in the background and returns a Future for the result.
+        :param timeout: seconds before the future fails with TimeoutError. Defaults to default_timeout.
+        :param coalesce: if True, share the result with an identical call already in flight
+        :param exclusive: if True, the call never runs at the same time as another exclusive call
+        """
+        func = getattr(self.controller, name)
+        if exclusive:
+            func = self._exclusive(func)
+        key = _get_key(name, args, kwargs) if coalesce else None
+        waiter = concurrent.futures.Future()
+        with self._lock:
+            call = self._in_flight.get(key) if key else None
+            if call is None:
+                call = _Call()
+                call.future = self._executor.submit(func, *args, **kwargs)
+                if key:
+                    self._in_flight[key] = call
+                call.future.add_done_callback(lambda future: self._call_done(key, call, future))
+            else:
+                logger.debug(f'Coalescing call to {name}')
+            call.add_waiter(waiter)
+        waiter.add_done_callback(lambda future: future.cancelled() and self._remove_waiter(call, future))
+        if call.future.done():
+            call.deliver(call.future)
+        timeout = self.default_timeout if timeout is None else timeout
+        if timeout is not None:
+            self._start_timer(waiter, call, name, timeout)
+        return waiter
+
+    def _exclusive(self, func):
+        def wrapper(*args, **kwargs):
+            with self._exclusive_lock:
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _remove_waiter(self, call, waiter):
+        with self._lock:
+            removed, empty = call.remove_waiter(waiter)
+            if empty:
+                # Nobody waits for the result. Cancel the call if it has not started. Done under the lock so that
+                # no new caller is coalesced with a call that is being cancelled.
+                call.future.cancel()
+        return removed
+
+    def _call_done(self, key, call, future):
+        if key:
+            with self._lock:
+                if self._in_flight.get(key) is call:
+                    del self._in_flight[key]
+        call.deliver(future)
+
+    def _start_timer(self, waiter, call, name, timeout):
+        def expire():
+            if not self._remove_waiter(call, waiter) or not waiter.set_running_or_notify_cancel():
+                return
+            waiter.set_exception(TimeoutError(f'{name} did not finish within {timeout} s'))
+
+        def on_done(future):
+            timer.cancel()
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        waiter.add_done_callback(on_done)
+
+    @property
+    def in_flight(self):
+        """Number of coalescable calls running or queued."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def shutdown(self, cancel_pending=True):
+        """Stops the thread pool. Calls not yet started are cancelled if cancel_pending is True."""
+        self._executor.shutdown(wait=False, cancel_futures=cancel_pending)
+
+    get_svepa_info = _future_method('get_svepa_info')
+    series_exists = _future_method('series_exists')
+    get_next_serno = _future_method('get_next_serno')
+    get_latest_serno = _future_method('get_latest_serno')
+    get_latest_series_path = _future_method('get_latest_series_path')
+    get_server_listings = _future_method('get_server_listings')
+    get_closest_station = _future_method('get_closest_station')
+    get_nearest_stations = _future_method('get_nearest_stations')
+    get_station_info = _future_method('get_station_info')
+    get_station_infos = _future_method('get_station_infos')
+    get_distance_to_station = _future_method('get_distance_to_station')
+    update_main_psa_file = _future_method('update_main_psa_file', coalesce=False, exclusive=True)
+    reserve_serno = _future_method('reserve_serno', coalesce=False)
+    release_serno = _future_method('release_serno', coalesce=False)
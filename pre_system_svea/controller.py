@@ -1,20 +1,25 @@
 import datetime
+import logging
 import os
-import subprocess
 import threading
 from pathlib import Path
 
-import file_explorer
-import psutil
-from file_explorer import psa
-from file_explorer import seabird
-from file_explorer.seabird import paths
+from pre_system_svea import instrumentation
 from pre_system_svea.ctd_config import CtdConfig
 from pre_system_svea.operator import Operators
+from pre_system_svea.package_index import PackageIndex
+from pre_system_svea.psa_transaction import PSATransaction
+from pre_system_svea.seasave import SeasaveSupervisor
+from pre_system_svea.serno_ledger import SernoLedger
+from pre_system_svea.server_listing import ServerDirectoryScanner
 from pre_system_svea.ship import Ships
-from pre_system_svea.station import Stations
-from svepa import exceptions as svepa_exceptions
-import svepa
+from pre_system_svea.svepa_info import SvepaInfoService
+from pre_system_svea.xmlcon_cache import XmlconCache
+
+# Heavy dependencies (pandas/numpy via stations, file_explorer, psutil, svepa, requests) are imported
+# where they are first needed so that e.g. the operator and ship lists are available without loading them.
+
+logger = logging.getLogger(__name__)
 
 
 class Controller:
@@ -24,12 +29,65 @@ class Controller:
         self.ctd_files = None
 
         self._paths = paths_object
+        self._xmlcon_cache = XmlconCache()
+        self.seasave = SeasaveSupervisor()
+        self._package_indexes = {}
+        self._package_indexes_lock = threading.Lock()
+        self._server_listing_ttl = kwargs.get('server_listing_ttl', 30)
+        self._server_listing_timeout = kwargs.get('server_listing_timeout', 2)
+        self._server_scanner = self._create_server_scanner()
+        self._preload_xmlcon = kwargs.get('preload_xmlcon', False)
+        self._svepa_poll_interval = kwargs.get('svepa_poll_interval', 10)
+        self._svepa_first_wait = kwargs.get('svepa_first_wait', 10)
+        self._svepa_module = kwargs.get('svepa_module')
+        self._svepa_services = {}
+        self._svepa_services_lock = threading.Lock()
+        self._serno_ledger_directory = kwargs.get('serno_ledger_directory')
+        self._serno_ledger_owner = kwargs.get('serno_ledger_owner')
+        self._serno_ledgers = {}
+        self._serno_ledgers_lock = threading.Lock()
 
         self.operators = Operators()
-        # self.stations = Stations(update_primary=kwargs.get('update_primary_station_list'))
-        self.stations = Stations()
+        self._update_primary_station_list = kwargs.get('update_primary_station_list')
+        self._on_station_list_updated = kwargs.get('on_station_list_updated')
+        self._stations = None
+        self._stations_lock = threading.Lock()
         self.ships = Ships()
 
+    @staticmethod
+    def enable_instrumentation(path=None, sink=None):
+        """
+        Records call counts, latency histograms and I/O bytes for the controller operations and the loaders.
+        Each call is written as a JSON line to path or sent to sink. See the instrumentation module.
+        """
+        return instrumentation.enable(sink=sink, path=path)
+
+    @staticmethod
+    def disable_instrumentation():
+        instrumentation.disable()
+
+    @staticmethod
+    def get_latency_stats():
+        """Returns the latency summary per operation, or an empty dict if instrumentation is disabled."""
+        recorder = instrumentation.get_instrumentation()
+        if recorder is None:
+            return {}
+        return recorder.snapshot()
+
+    @property
+    def stations(self):
+        if self._stations is None:
+            with self._stations_lock:
+                if self._stations is None:
+                    from pre_system_svea.station import Stations
+                    # The primary station list is updated in the background. on_station_list_updated is called
+                    # (from that thread) when the new list is in use.
+                    stations = Stations(update_primary=self._update_primary_station_list)
+                    if self._on_station_list_updated:
+                        stations.add_update_callback(self._on_station_list_updated)
+                    self._stations = stations
+        return self._stations
+
     @property
     def ctd_config_root_directory(self):
         return self._paths('config_dir')
@@ -37,7 +95,14 @@ class Controller:
     @ctd_config_root_directory.setter
     def ctd_config_root_directory(self, directory):
         self._paths.set_config_root_directory(directory)
-        self.ctd_config = CtdConfig(self._paths('config_dir'))
+        xmlcon_cache = self._xmlcon_cache if self._preload_xmlcon else None
+        config_dir = self._paths('config_dir')
+        # Setting the same root again keeps the paths already resolved. Changes are picked up by CtdConfig.
+        if self.ctd_config is not None and self.ctd_config.root_directory == Path(config_dir):
+            if xmlcon_cache is not None:
+                self.ctd_config.preload_xmlcon_files(xmlcon_cache)
+            return
+        self.ctd_config = CtdConfig(config_dir, xmlcon_cache=xmlcon_cache)
 
     @property
     def ctd_data_directory(self):
@@ -55,9 +120,36 @@ class Controller:
     def ctd_data_root_directory_server(self, directory):
         self._paths.set_server_root_directory(directory)
 
-    def get_svepa_info(self, credentials_path):
-        info = svepa.get_current_station_info(path_to_svepa_credentials=credentials_path)
-        return info
+    def _get_svepa_service(self, credentials_path):
+        key = str(credentials_path)
+        with self._svepa_services_lock:
+            service = self._svepa_services.get(key)
+            if service is None:
+                service = SvepaInfoService(credentials_path, interval=self._svepa_poll_interval,
+                                           svepa_module=self._svepa_module)
+                self._svepa_services[key] = service
+        service.start()
+        return service
+
+    @instrumentation.timed('controller.get_svepa_info')
+    def get_svepa_info(self, credentials_path, allow_stale=False):
+        """
+        Returns the latest current station info from SVEPA. SVEPA is polled in the background so this returns
+        from memory. If the info is missing or stale SVEPA is asked again (waiting at most svepa_first_wait
+        seconds) and ConnectionError or TimeoutError is raised if that fails. Other errors from SVEPA are raised as
+        they are. Use get_svepa_snapshot to see how old the info is.
+        :param allow_stale: return the last known info instead of raising when SVEPA can not be reached
+        """
+        return self._get_svepa_service(credentials_path).get_info(wait=self._svepa_first_wait,
+                                                                  allow_stale=allow_stale)
+
+    def get_svepa_snapshot(self, credentials_path):
+        """Returns the latest svepa_info.SvepaSnapshot (info, fetched_time, age, stale, error) without waiting."""
+        return self._get_svepa_service(credentials_path).get_snapshot()
+
+    def refresh_svepa_info(self, credentials_path):
+        """Asks SVEPA again now instead of waiting for the next poll."""
+        self._get_svepa_service(credentials_path).refresh()
 
     def get_station_list(self):
         return self.stations.get_station_list()
@@ -65,37 +157,58 @@ class Controller:
     def get_operator_list(self):
         return self.operators.get_operator_list()
 
+    @instrumentation.timed('controller.get_closest_station')
     def get_closest_station(self, lat, lon):
         return self.stations.get_closest_station(lat, lon)
 
+    def get_closest_stations(self, lat, lon=None, **kwargs):
+        return self.stations.get_closest_stations(lat, lon, **kwargs)
+
+    def create_position_monitor(self, **kwargs):
+        """
+        Returns a PositionMonitor following the closest station for a stream of NMEA positions.
+        Start it with monitor.start(source) where source is a file path, socket or iterable of NMEA sentences.
+        """
+        from pre_system_svea.position_monitor import PositionMonitor
+        return PositionMonitor(self.stations, **kwargs)
+
+    def get_nearest_stations(self, lat, lon, k=5):
+        return self.stations.get_nearest_stations(lat, lon, k=k)
+
+    def get_stations_within_radius(self, lat, lon, radius):
+        return self.stations.get_stations_within_radius(lat, lon, radius)
+
+    def get_stations_covering_position(self, lat, lon):
+        return self.stations.get_stations_covering_position(lat, lon)
+
+    @instrumentation.timed('controller.get_station_info')
     def get_station_info(self, station_name):
         return self.stations.get_station_info(station_name)
     
+    @instrumentation.timed('controller.get_station_infos')
+    def get_station_infos(self, station_names):
+        """Returns (found, unresolved) for many station names. See StationFile.get_station_infos."""
+        return self.stations.get_station_infos(station_names)
+
     def get_distance_to_station(self, lat, lon, station_name):
         return self.stations.get_distance_to_station(lat, lon, station_name)
 
-    def _get_running_programs(self):
-        program_list = []
-        for p in psutil.process_iter():
-            program_list.append(p.name())
-        return program_list
-
+    @instrumentation.timed('controller.run_seasave')
     def run_seasave(self):
-        if 'Seasave.exe' in self._get_running_programs():
-            # filezilla.exe
-            raise ChildProcessError('Seasave is already running!')
+        """
+        Starts Seasave with the main psa file. Raises ChildProcessError if Seasave is already running.
+        Use self.seasave (SeasaveSupervisor) to follow the process: started/exited events, exit callbacks and
+        returncode.
+        """
+        return self.seasave.start(self.ctd_config.seasave_program_path, self.ctd_config.seasave_psa_main_file)
 
-        t = threading.Thread(target=self._subprocess_seasave)
-        t.daemon = True  # close pipe if GUI process exits
-        t.start()
-
-    def _subprocess_seasave(self):
-        subprocess.run([str(self.ctd_config.seasave_program_path), f'-p={self.ctd_config.seasave_psa_main_file}'])
+    def seasave_is_running(self):
+        return self.seasave.is_running()
 
     def get_xmlcon_path(self, instrument):
         try:
             return str(self.ctd_config.seasave_xmlcon_files[instrument])
-        except ValueError:
+        except (KeyError, ValueError):
             raise ValueError(f'Incorrect instrument number: {instrument}')
 
     def get_seasave_psa_path(self):
@@ -103,18 +216,27 @@ class Controller:
 
     def _get_xmlcon_object(self, instrument):
         xmlcon_file_path = self.get_xmlcon_path(instrument)
-        obj = seabird.XmlconFile(xmlcon_file_path, ignore_pattern=True)
-        return obj
+        return self._xmlcon_cache.get(xmlcon_file_path)
 
     def _get_main_psa_object(self):
-        return psa.SeasavePSAfile(self.ctd_config.seasave_psa_main_file)
+        from file_explorer import psa
+        file_path = self.ctd_config.seasave_psa_main_file
+        with instrumentation.measure('psa.load', nbytes=os.path.getsize(file_path)):
+            return psa.SeasavePSAfile(file_path)
+
+    def main_psa_transaction(self):
+        """Returns a PSATransaction for the main PSA file. Use as a context manager."""
+        return PSATransaction(self._get_main_psa_object, file_path=self.ctd_config.seasave_psa_main_file)
 
-    def update_xmlcon_in_main_psa_file(self, instrument):
+    def update_xmlcon_in_main_psa_file(self, instrument, psa_obj=None):
         xmlcon_file_path = self.get_xmlcon_path(instrument)
-        psa_obj = self._get_main_psa_object()
-        psa_obj.xmlcon_path = xmlcon_file_path
-        psa_obj.save()
+        if psa_obj is not None:
+            psa_obj.xmlcon_path = xmlcon_file_path
+            return
+        with self.main_psa_transaction() as psa_obj:
+            psa_obj.xmlcon_path = xmlcon_file_path
 
+    @instrumentation.timed('controller.update_main_psa_file')
     def update_main_psa_file(self,
                              instrument=None,
                              depth=None,
@@ -139,65 +261,82 @@ class Controller:
         if not year:
             year = str(datetime.datetime.now().year)
 
-        if instrument:
-            self._instrument = instrument
-            print('INSTRUMENT', instrument)
-            self.update_xmlcon_in_main_psa_file(instrument)
-            
-
-        if self.series_exists(
-                # server=True,
-                cruise=cruise_nr,
-                year=year,
-                ship=ship_code,
-                serno=serno,
-                source_dir=source_dir, 
-                check_serno=kwargs.get('check_serno')
-        ):
-            raise Exception(f'Serien med serienummer {serno} existerar redan på servern!')
-
-        hex_file_path = self.get_data_file_path(instrument=instrument,
-                                                cruise=cruise_nr,
-                                                ship=ship_code,
-                                                serno=serno,
-                                                tail=tail)
-        directory = hex_file_path.parent
-        if not directory.exists():
-            os.makedirs(directory)
-
-        psa_obj = self._get_main_psa_object()
-        psa_obj.data_path = hex_file_path
-
-        if depth:
-            psa_obj.display_depth = depth
-
-        if nr_bins:
-            psa_obj.nr_bins = nr_bins
-
-        psa_obj.station = station
-
-        psa_obj.operator = operator
-
-        psa_obj.lims_job = lims_job or ''
-
-        if ship_code:
-            psa_obj.ship = f'{self.ships.get_code(ship_code)} {self.ships.get_name(ship_code)}'
-
-        if cruise_nr and ship_code and year:
-            psa_obj.cruise = f'{self.ships.get_code(ship_code)}-{year}-{cruise_nr.zfill(2)}'
-
-        psa_obj.position = position
-
-        psa_obj.pumps = pumps
-
-        psa_obj.event_ids = event_ids
-
-        psa_obj.add_samp = add_samp
-
-        psa_obj.metadata_admin = metadata_admin
-        psa_obj.metadata_conditions = metadata_conditions
-
-        psa_obj.save()
+        # All changes are collected and written to the main psa file at the end, in one save.
+        # Nothing is written if any of the checks below fails, and a serno reserved here is released again.
+        reserved = False
+        try:
+            with self.main_psa_transaction() as psa_obj:
+                if instrument:
+                    self._instrument = instrument
+                    logger.debug(f'Updating main psa file for instrument {instrument}')
+                    self.update_xmlcon_in_main_psa_file(instrument, psa_obj=psa_obj)
+
+                if cruise_nr and ship_code and serno and not kwargs.get('check_serno'):
+                    # Rejects sernos used in the local, source or server directories or reserved by another
+                    # preparation, and reserves serno for this one until the package is written.
+                    try:
+                        self.reserve_serno(year=year, ship=ship_code, cruise=cruise_nr, serno=serno)
+                    except ValueError as e:
+                        raise Exception(f'Serien med serienummer {serno} existerar redan! ({e})')
+                    reserved = True
+                elif self.series_exists(
+                        # server=True,
+                        cruise=cruise_nr,
+                        year=year,
+                        ship=ship_code,
+                        serno=serno,
+                        source_dir=source_dir,
+                        check_serno=kwargs.get('check_serno')
+                ):
+                    raise Exception(f'Serien med serienummer {serno} existerar redan på servern!')
+
+                hex_file_path = self.get_data_file_path(instrument=instrument,
+                                                        cruise=cruise_nr,
+                                                        ship=ship_code,
+                                                        serno=serno,
+                                                        tail=tail)
+                directory = hex_file_path.parent
+                if not directory.exists():
+                    os.makedirs(directory)
+
+                psa_obj.data_path = hex_file_path
+
+                if depth:
+                    psa_obj.display_depth = depth
+
+                if nr_bins:
+                    psa_obj.nr_bins = nr_bins
+
+                psa_obj.station = station
+
+                psa_obj.operator = operator
+
+                psa_obj.lims_job = lims_job or ''
+
+                if ship_code:
+                    psa_obj.ship = f'{self.ships.get_code(ship_code)} {self.ships.get_name(ship_code)}'
+
+                if cruise_nr and ship_code and year:
+                    psa_obj.cruise = f'{self.ships.get_code(ship_code)}-{year}-{cruise_nr.zfill(2)}'
+
+                psa_obj.position = position
+
+                psa_obj.pumps = pumps
+
+                psa_obj.event_ids = event_ids
+
+                psa_obj.add_samp = add_samp
+
+                psa_obj.metadata_admin = metadata_admin
+                psa_obj.metadata_conditions = metadata_conditions
+        except BaseException:
+            if reserved:
+                try:
+                    self.release_serno(year=year, ship=ship_code, cruise=cruise_nr)
+                except Exception as e:
+                    # The reservation expires by itself. The original error is the one to raise.
+                    logger.warning(f'Could not release serno {serno}: {e}')
+            raise
 
     def get_data_file_path(self, instrument=None, cruise=None, ship=None, serno=None, tail=None):
         missing = []
@@ -249,6 +388,86 @@ class Controller:
         else:
             return self._paths.get_local_directory('raw', year=year, **kwargs)
 
+    def _get_package_index(self, directory, server=False):
+        key = (os.path.abspath(directory), server)
+        with self._package_indexes_lock:
+            if key not in self._package_indexes:
+                scanner = self._server_scanner if server else None
+                self._package_indexes[key] = PackageIndex(directory, scanner=scanner)
+            return self._package_indexes[key]
+
+    def _get_server_raw_data_path(self, year):
+        """Returns the server raw data directory for year. None if no server root is set or it can not be resolved."""
+        try:
+            if not self.ctd_data_root_directory_server:
+                return None
+            return self._get_raw_data_path(server=True, year=year)
+        except Exception as e:
+            logger.warning(f'Could not resolve the server raw data directory for {year}: {e}')
+            return None
+
+    def _get_serno_ledger(self, year):
+        year = str(year)
+        local_directory = self._get_raw_data_path(year=year)
+        source_directory = self._paths.get_local_directory('source')
+        server_directory = self._get_server_raw_data_path(year)
+        # The directories are part of the key so that setting the source directory or the server root gives a
+        # ledger that checks them too
+        key = (year, str(local_directory), source_directory and str(source_directory),
+               server_directory and str(server_directory))
+        with self._serno_ledgers_lock:
+            ledger = self._serno_ledgers.get(key)
+            if ledger is None:
+                local_directory = Path(self._get_raw_data_path(year=year, create=True))
+                directories = [local_directory]
+                if source_directory:
+                    directories.append(source_directory)
+                ledger_directory = Path(self._serno_ledger_directory or Path(local_directory.parent, '.serno_ledger'))
+                ledger_directory.mkdir(parents=True, exist_ok=True)
+                # Kept outside the raw data directories so that writing the ledger does not trigger the
+                # package index watchers
+                ledger = SernoLedger(Path(ledger_directory, f'serno_ledger_{year}.json'),
+                                     directories=directories,
+                                     server_directories=[server_directory] if server_directory else [],
+                                     scanner=self._server_scanner,
+                                     owner=self._serno_ledger_owner)
+                self._serno_ledgers[key] = ledger
+            return ledger
+
+    @instrumentation.timed('controller.get_server_listings')
+    def get_server_listings(self, years, **kwargs):
+        """
+        Lists the server raw data directories for the given years in parallel.
+        Returns a dict with year as key and a server_listing.DirectoryListing as value. A listing has stale=True
+        if the server did not answer within the timeout.
+        """
+        directories = {year: self._get_raw_data_path(server=True, year=year, **kwargs) for year in years}
+        listings = self._server_scanner.list_directories(directories.values())
+        return {year: listings[str(Path(directory))] for year, directory in directories.items()}
+
+    def _create_server_scanner(self):
+        return ServerDirectoryScanner(ttl=self._server_listing_ttl, timeout=self._server_listing_timeout)
+
+    def close(self):
+        """
+        Stops directory watchers, server listing threads and SVEPA pollers held by the controller.
+        The controller can still be used after close: they are created again when needed.
+        """
+        with self._package_indexes_lock:
+            for index in self._package_indexes.values():
+                index.close()
+            self._package_indexes = {}
+        with self._serno_ledgers_lock:
+            # The ledgers list the server through the scanner that is shut down below
+            self._serno_ledgers = {}
+        server_scanner, self._server_scanner = self._server_scanner, self._create_server_scanner()
+        server_scanner.shutdown()
+        with self._svepa_services_lock:
+            services, self._svepa_services = self._svepa_services, {}
+        for service in services.values():
+            service.stop(timeout=1)
+
+    @instrumentation.timed('controller.series_exists')
     def series_exists(self, return_file_name=False, server=False, **kwargs):
         root_path = None
         if kwargs.get('source_dir'):
@@ -257,7 +476,7 @@ class Controller:
             root_path = self._get_raw_data_path(server=server, year=kwargs.get('year'), create=True)
         if not root_path:
             return False
-        pack_col = file_explorer.get_package_collection_for_directory(root_path)
+        pack_col = self._get_package_index(root_path, server=server)
         if kwargs.get('check_serno'):
             return pack_col.series_exists(serno=kwargs.get('serno'))
         else:
@@ -266,16 +485,18 @@ class Controller:
         # ctd_files_obj = get_ctd_files_object(root_path, suffix='.hex')
         # return ctd_files_obj.series_exists(return_file_name=return_file_name, **kwargs)
 
+    @instrumentation.timed('controller.get_latest_serno')
     def get_latest_serno(self, server=False, **kwargs):
         root_path = self._get_raw_data_path(server=server, year=kwargs.get('year'), create=True)
-        pack_col = file_explorer.get_package_collection_for_directory(root_path)
+        pack_col = self._get_package_index(root_path, server=server)
         return pack_col.get_latest_serno(**kwargs)
         # ctd_files_obj = get_ctd_files_object(root_path, suffix='.hex')
         # return ctd_files_obj.get_latest_serno(**kwargs)
 
+    @instrumentation.timed('controller.get_latest_series_path')
     def get_latest_series_path(self, server=False, **kwargs):
         root_path = self._get_raw_data_path(server=server, year=kwargs.get('year'), create=True)
-        pack_col = file_explorer.get_package_collection_for_directory(root_path)
+        pack_col = self._get_package_index(root_path, server=server)
         latest_pack = pack_col.get_latest_series(**kwargs)
         if not latest_pack:
             return
@@ -284,15 +505,39 @@ class Controller:
         # # inga filer här av någon anledning....
         # return ctd_files_obj.get_latest_series(path=True, **kwargs)
 
+    @instrumentation.timed('controller.get_next_serno')
     def get_next_serno(self, server=False, **kwargs):
+        """
+        Returns the next serno for year/ship/cruise from the serno ledger, i.e. the next serno not used in the
+        local, source or server directories and not reserved by another preparation.
+        """
+        if all(kwargs.get(key) for key in ['year', 'ship', 'cruise']):
+            return self._get_serno_ledger(kwargs['year']).next_serno(kwargs['year'],
+                                                                      self.ships.get_code(kwargs['ship']),
+                                                                      kwargs['cruise'])
         root_path = self._get_raw_data_path(server=server, year=kwargs.get('year'), create=True)
-        pack_col = file_explorer.get_package_collection_for_directory(root_path)
+        pack_col = self._get_package_index(root_path, server=server)
         return pack_col.get_next_serno(**kwargs)
         # ctd_files_obj = get_ctd_files_object(root_path, suffix='.hex')
         # return ctd_files_obj.get_next_serno(**kwargs)
 
+    @instrumentation.timed('controller.reserve_serno')
+    def reserve_serno(self, year=None, ship=None, cruise=None, serno=None):
+        """
+        Reserves serno (or the next free serno) for year/ship/cruise so that no other preparation can use it.
+        Returns the reserved serno. Raises ValueError if serno is already used or reserved.
+        """
+        year = year or str(datetime.datetime.now().year)
+        return self._get_serno_ledger(year).reserve(year, self.ships.get_code(ship), cruise, serno=serno)
+
+    def release_serno(self, year=None, ship=None, cruise=None):
+        """Drops the serno reservation made by this controller for year/ship/cruise."""
+        year = year or str(datetime.datetime.now().year)
+        self._get_serno_ledger(year).release(year, self.ships.get_code(ship), cruise)
+
 
 if __name__ == '__main__':
+    from file_explorer.seabird import paths
     sbe_paths = paths.SBEPaths()
     c = Controller(paths_object=sbe_paths)
     c.ctd_config_root_directory = r'C:\mw\git\ctd_config'
@@ -0,0 +1,134 @@
+"""
+Conversion of positions between degrees and decimal minutes (DDMM.mm, e.g. LAT_DM/LONG_DM in the station list)
+and decimal degrees.
+
+All functions work on scalars as well as on sequences and numpy arrays. A scalar gives a float back and
+anything else a numpy array. Negative values are positions south of the equator or west of Greenwich:
+-1159.30 is 11 degrees 59.30 minutes west, i.e. -11.98833 decimal degrees.
+
+Input that can not be converted (text that is not a number, minutes >= 60) raises ValueError when
+errors='raise' (default) and is returned as NaN when errors='coerce'. Missing values (None or NaN) are always
+returned as NaN.
+"""
+import math
+
+import numpy as np
+
+
+def is_sequence(arg):
+    """Checks if an object is iterable (you can loop over it) and not a string"""
+    return (not hasattr(arg, "strip") and
+            hasattr(arg, "__iter__"))
+
+
+def _to_float_array(pos, errors):
+    if errors not in ('raise', 'coerce'):
+        raise ValueError(f'errors must be "raise" or "coerce", not {errors}')
+    scalar = not is_sequence(pos)
+    try:
+        arr = np.asarray(pos, dtype=float)
+    except (TypeError, ValueError):
+        if errors == 'raise':
+            raise ValueError(f'Could not convert position to number: {pos}')
+        arr = np.array([_to_float_or_nan(p) for p in np.ravel(np.asarray(pos, dtype=object))])
+        arr = arr.reshape(np.shape(pos))
+    return arr, scalar
+
+
+def _to_float(pos, errors):
+    if pos is None:
+        return math.nan
+    try:
+        return float(pos)
+    except (TypeError, ValueError):
+        if errors == 'raise':
+            raise ValueError(f'Could not convert position to number: {pos}')
+        return math.nan
+
+
+def _decmin_to_decdeg_value(value, errors):
+    # Scalar version of the array conversion (same operations, same result) without the numpy overhead.
+    if math.isnan(value):
+        return value
+    absolute = abs(value)
+    minutes = absolute % 100
+    if minutes >= 60:
+        if errors == 'raise':
+            raise ValueError(f'Minutes must be less than 60 in: {value}')
+        return math.nan
+    sign = (value > 0) - (value < 0)
+    return sign * (math.floor(absolute / 100.) + minutes / 60.)
+
+
+def _to_float_or_nan(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _check_invalid(arr, invalid, errors, message):
+    """Raises ValueError or masks (sets NaN) where invalid is True"""
+    if not np.any(invalid):
+        return arr
+    if errors == 'raise':
+        raise ValueError(f'{message}: {np.atleast_1d(arr[invalid])[:5]}')
+    arr = np.array(arr, dtype=float)
+    arr[invalid] = np.nan
+    return arr
+
+
+def _format(arr, scalar, string_type, decimals=False):
+    if string_type:
+        if decimals is not False:
+            strings = np.array([f'{value:.{decimals}f}' for value in np.ravel(arr)])
+        else:
+            strings = np.array([str(value) for value in np.ravel(arr)])
+        if scalar:
+            return str(strings[0])
+        return strings.reshape(np.shape(arr))
+    if scalar:
+        return float(arr)
+    return arr
+
+
+def decmin_to_decdeg(pos, return_string=False, errors='raise'):
+    """
+    Converts degrees and decimal minutes (DDMM.mm) to decimal degrees.
+    :param pos: scalar, sequence or array of positions. Numbers or strings.
+    :param return_string: If True the result is returned as str (or array of str)
+    :param errors: 'raise' or 'coerce'. See module docstring.
+    """
+    if not is_sequence(pos) and not return_string:
+        if errors not in ('raise', 'coerce'):
+            raise ValueError(f'errors must be "raise" or "coerce", not {errors}')
+        return _decmin_to_decdeg_value(_to_float(pos, errors), errors)
+    arr, scalar = _to_float_array(pos, errors)
+    absolute = np.abs(arr)
+    minutes = absolute % 100
+    with np.errstate(invalid='ignore'):
+        arr = _check_invalid(arr, minutes >= 60, errors, 'Minutes must be less than 60 in')
+    output = np.sign(arr) * (np.floor(absolute / 100.) + minutes / 60.)
+    return _format(output, scalar, return_string)
+
+
+def decdeg_to_decmin(pos, string_type=False, decimals=False, errors='raise'):
+    """
+    Converts decimal degrees to degrees and decimal minutes (DDMM.mm).
+    :param pos: scalar, sequence or array of positions. Numbers or strings.
+    :param string_type: If True the result is returned as str (or array of str)
+    :param decimals: number of decimals in the string output. All decimals are kept if False.
+    :param errors: 'raise' or 'coerce'. See module docstring.
+    """
+    arr, scalar = _to_float_array(pos, errors)
+    absolute = np.abs(arr)
+    degrees = np.floor(absolute)
+    minutes = (absolute - degrees) * 60.
+    if decimals is not False:
+        # Minutes rounding up to 60 (57.99999 with two decimals) are carried over to the degrees: 5800.00
+        minutes = np.round(minutes, decimals)
+        carry = minutes >= 60.
+        degrees = np.where(carry, degrees + 1., degrees)
+        minutes = np.where(carry, minutes - 60., minutes)
+    output = np.sign(arr) * (degrees * 100. + minutes)
+    return _format(output, scalar, string_type, decimals=decimals)
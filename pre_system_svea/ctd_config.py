@@ -1,18 +1,125 @@
+import logging
+import threading
+import time
+from collections.abc import Mapping
 from pathlib import Path
 import yaml
 
+from pre_system_svea import instrumentation
+from pre_system_svea.package_index import MTIME_RESOLUTION
+
+logger = logging.getLogger(__name__)
+
+
+def _get_mtime(path):
+    try:
+        return path.stat().st_mtime
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def _is_current(entry, mtime):
+    """entry is (mtime, checked_time, value) from the last scan of a directory"""
+    return entry is not None and mtime is not None and entry[0] == mtime and entry[1] - mtime > MTIME_RESOLUTION
+
+
+class XmlconFiles(Mapping):
+    """
+    Mapping instrument name -> xmlcon file for the instrument directories in the XMLCON directory.
+
+    Nothing is scanned until used. An instrument directory is listed the first time the instrument is asked for
+    and again only if the mtime of the directory has changed (an xmlcon file added, removed or replaced). The
+    instrument list is checked the same way against the mtime of the XMLCON directory. With the config root on
+    a network share a lookup is then a single stat.
+
+    Looking up an instrument whose directory has no or several xmlcon files raises FileNotFoundError or
+    FileExistsError. Other instruments can still be used.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._instruments = None
+        self._files = {}
+
+    def _list_instruments(self):
+        mtime = _get_mtime(self.directory)
+        with self._lock:
+            entry = self._instruments
+            if _is_current(entry, mtime):
+                return entry[2]
+            checked_time = time.time()
+            if mtime is None:
+                names = ()
+            else:
+                names = tuple(sorted(path.name for path in self.directory.iterdir() if path.is_dir()))
+            self._instruments = (mtime, checked_time, names)
+            for name in set(self._files) - set(names):
+                del self._files[name]
+            return names
+
+    @staticmethod
+    def _find_xmlcon(directory):
+        xmlcons = [path for path in directory.iterdir() if path.suffix.lower().endswith('.xmlcon')]
+        if not xmlcons:
+            return FileNotFoundError, f'No xmlcon file found for {directory.name}'
+        if len(xmlcons) > 1:
+            return FileExistsError, f'Too many xmlcon files found for {directory.name} in directory: {directory}'
+        return xmlcons[0]
+
+    def __getitem__(self, instrument):
+        directory = Path(self.directory, instrument)
+        mtime = _get_mtime(directory)
+        with self._lock:
+            if mtime is None or not directory.is_dir():
+                self._files.pop(instrument, None)
+                raise KeyError(instrument)
+            entry = self._files.get(instrument)
+            if _is_current(entry, mtime):
+                value = entry[2]
+            else:
+                checked_time = time.time()
+                with instrumentation.measure('ctd_config.resolve_xmlcon'):
+                    value = self._find_xmlcon(directory)
+                self._files[instrument] = (mtime, checked_time, value)
+        if isinstance(value, tuple):
+            exception, message = value
+            raise exception(message)
+        return value
+
+    def __contains__(self, instrument):
+        return instrument in self._list_instruments()
+
+    def __iter__(self):
+        return iter(self._list_instruments())
+
+    def __len__(self):
+        return len(self._list_instruments())
+
+    def clear(self):
+        with self._lock:
+            self._instruments = None
+            self._files = {}
+
 
 class CtdConfig:
-    def __init__(self, root_directory):
+    @instrumentation.timed('ctd_config.load')
+    def __init__(self, root_directory, xmlcon_cache=None):
+        """
+        Paths are resolved when first used. See XmlconFiles for how changes to the xmlcon files are picked up.
+        :param root_directory: root directory of the ctd_config repository
+        :param xmlcon_cache: optional XmlconCache. If given, the xmlcon files for all instruments are parsed into it.
+        """
 
         self.root_directory = Path(root_directory)
 
         self.resource_settings_file_path = Path(Path(__file__).parent, 'resources', 'ctd_config.yaml')
 
         self._config = {}
-        self.seasave_xmlcon_files = {}
+        self._seasave_xmlcon_files = None
         self._load_config_file()
-        self._save_paths()
+        if xmlcon_cache is not None:
+            self.preload_xmlcon_files(xmlcon_cache)
 
     def _load_config_file(self):
         with open(self.resource_settings_file_path, 'r') as fid:
@@ -22,7 +129,7 @@ class CtdConfig:
                 self.root_directory = None
                 raise exc
 
-    def _get_path(self, *args, must_exist=True, path_if_not_paths=False, suffix='', dirs=False):
+    def _get_full_path(self, *args):
         item = self._config
         for arg in args:
             item = item.get(arg, {})
@@ -30,9 +137,11 @@ class CtdConfig:
         if not path:
             raise ValueError
         if path.startswith('root'):
-            full_path = Path(self.root_directory, path[5:])
-        else:
-            full_path = Path(path)
+            return Path(self.root_directory, path[5:])
+        return Path(path)
+
+    def _get_path(self, *args, must_exist=True, path_if_not_paths=False, suffix='', dirs=False):
+        full_path = self._get_full_path(*args)
         if must_exist and not full_path.exists():
             raise FileNotFoundError(full_path)
         if not dirs:
@@ -63,22 +172,36 @@ class CtdConfig:
             paths = paths[0]
         return paths
 
-    def _save_paths(self):
-        self.seasave_program_path = self._get_path('seasave', 'program')
-        self.seasave_psa_main_file = self._get_path('seasave', 'psa_main_file')
-        self.xmlcon_dir = self._get_path('seasave', 'xmlcon_dir', dirs=True)
-        for path in self.xmlcon_dir:
-            self._save_path_general(path)
+    @property
+    def seasave_program_path(self):
+        return self._get_path('seasave', 'program')
 
-    def _save_path_general(self, path):
-        instrument_name = path.name
-        xmlcons = [i for i in path.iterdir() if i.suffix.lower().endswith('.xmlcon')]
-        if not xmlcons:
-            raise FileNotFoundError(f'No xmlcon file found for {instrument_name}')
-        if type(xmlcons) == list and len(xmlcons)>1:
-            raise FileExistsError(
-                f'Too many xmlcon files found for {instrument_name} in directory: {xmlcons[0].parent}')
-        self.seasave_xmlcon_files[instrument_name] = xmlcons[0]
+    @property
+    def seasave_psa_main_file(self):
+        return self._get_path('seasave', 'psa_main_file')
+
+    @property
+    def seasave_xmlcon_files(self):
+        if self._seasave_xmlcon_files is None:
+            self._seasave_xmlcon_files = XmlconFiles(self._get_full_path('seasave', 'xmlcon_dir'))
+        return self._seasave_xmlcon_files
+
+    @property
+    def xmlcon_dir(self):
+        return [Path(self.seasave_xmlcon_files.directory, name) for name in self.seasave_xmlcon_files]
+
+    def refresh(self):
+        """Forgets all resolved xmlcon files. Normally not needed since changes are detected from mtimes."""
+        self.seasave_xmlcon_files.clear()
+
+    def preload_xmlcon_files(self, xmlcon_cache):
+        file_paths = []
+        for instrument in self.seasave_xmlcon_files:
+            try:
+                file_paths.append(self.seasave_xmlcon_files[instrument])
+            except (KeyError, FileNotFoundError, FileExistsError) as e:
+                logger.warning(f'Could not preload xmlcon file for {instrument}: {e}')
+        xmlcon_cache.preload(file_paths)
 
 
 if __name__ == '__main__':
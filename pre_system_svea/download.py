@@ -0,0 +1,110 @@
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from pre_system_svea import instrumentation
+from pre_system_svea import utils
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_metadata_path(file_path):
+    file_path = Path(file_path)
+    return Path(file_path.parent, f'.{file_path.name}.download.json')
+
+
+def _load_metadata(file_path, url):
+    metadata_path = get_metadata_path(file_path)
+    if not Path(file_path).exists() or not metadata_path.exists():
+        return {}
+    try:
+        metadata = utils.load_json(metadata_path)
+    except (OSError, ValueError):
+        return {}
+    if metadata.get('url') != url:
+        return {}
+    return metadata
+
+
+def _get_conditional_headers(metadata):
+    headers = {}
+    if metadata.get('etag'):
+        headers['If-None-Match'] = metadata['etag']
+    if metadata.get('last_modified'):
+        headers['If-Modified-Since'] = metadata['last_modified']
+    return headers
+
+
+def _stream_to_temp_file(response, directory, prefix):
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=prefix)
+    try:
+        with os.fdopen(fd, 'wb') as fid, instrumentation.measure('download.body') as measurement:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    fid.write(chunk)
+                    measurement.add_bytes(len(chunk))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return Path(temp_path)
+
+
+def download_file(url, file_path, validate=None, timeout=30, retries=3, backoff=2.):
+    """
+    Downloads url to file_path if the remote file has changed since the last download.
+
+    The server is asked with ETag/If-Modified-Since from the previous download and nothing is transferred
+    if the file is unchanged. The body is streamed to a temporary file in the target directory that is
+    renamed into place only when complete and validated, so an interrupted download never leaves a
+    truncated file behind.
+
+    :param url: url to download
+    :param file_path: local file to update
+    :param validate: callable taking the path to the downloaded temporary file. Should raise ValueError
+                     if the content is not acceptable. The existing file is then kept.
+    :param timeout: timeout in seconds for connecting and for each read
+    :param retries: number of extra attempts on connection errors, timeouts and server errors
+    :param backoff: seconds to wait before the first retry. Doubled for each following retry.
+    :return: True if file_path was updated, False if the remote file was unchanged
+    """
+    import requests
+
+    file_path = Path(file_path)
+    metadata = _load_metadata(file_path, url)
+    headers = _get_conditional_headers(metadata)
+
+    for attempt in range(retries + 1):
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    logger.info(f'{file_path.name} is unchanged at {url}')
+                    return False
+                response.raise_for_status()
+                temp_path = _stream_to_temp_file(response, file_path.parent, f'.{file_path.name}')
+                new_metadata = dict(url=url,
+                                    etag=response.headers.get('ETag'),
+                                    last_modified=response.headers.get('Last-Modified'))
+            break
+        except requests.RequestException as e:
+            status_code = getattr(e.response, 'status_code', None)
+            if attempt == retries or (status_code and status_code < 500):
+                raise
+            wait = backoff * 2 ** attempt
+            logger.warning(f'Download of {url} failed ({e}). Retrying in {wait} s')
+            time.sleep(wait)
+
+    try:
+        if validate:
+            validate(temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if temp_path.exists():
+            os.remove(temp_path)
+        raise
+    utils.save_json(new_metadata, get_metadata_path(file_path))
+    logger.info(f'{file_path.name} updated from {url}')
+    return True
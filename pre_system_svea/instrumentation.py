@@ -0,0 +1,229 @@
+"""
+Optional latency instrumentation.
+
+Operations are timed with the timed decorator or the measure context manager and recorded (call count, latency
+histogram and I/O bytes) in the process wide Instrumentation object. Instrumentation is disabled by default,
+and then timed only adds a global lookup and an is None check to each call and measure returns a shared
+no-op context.
+
+    from pre_system_svea import instrumentation
+    instrumentation.enable(path='pre_system_latency.jsonl')
+    ...
+    instrumentation.get_instrumentation().export()
+
+Every recorded call is sent to the sink (if any) as one JSON line. export writes a summary line per operation.
+"""
+import bisect
+import datetime
+import functools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the histogram buckets: 1 us to about 17 minutes in steps of two
+BUCKET_BOUNDS = [1e-6 * 2 ** i for i in range(31)]
+
+_instrumentation = None
+
+
+class LatencyHistogram:
+    """Call count, total/min/max latency, I/O bytes and a log scale latency histogram for one operation."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+        self.nbytes = 0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds, nbytes=0):
+        self.count += 1
+        self.total += seconds
+        self.nbytes += nbytes
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def percentile(self, percent):
+        """Returns the upper bound of the bucket holding the given percentile (limited to max)."""
+        if not self.count:
+            return None
+        rank = percent / 100. * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKET_BOUNDS, self.buckets):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return dict(count=self.count,
+                    total=self.total,
+                    mean=self.total / self.count if self.count else None,
+                    min=self.min,
+                    max=self.max,
+                    p50=self.percentile(50),
+                    p90=self.percentile(90),
+                    p99=self.percentile(99),
+                    bytes=self.nbytes,
+                    buckets={f'{bound:g}': count
+                             for bound, count in zip(BUCKET_BOUNDS + [float('inf')], self.buckets) if count})
+
+
+class JsonLinesSink:
+    """Appends records as JSON lines to a local file. The file is kept open (line buffered) until close."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fid = None
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self._fid is None:
+                self._fid = open(self.path, 'a', buffering=1)
+            self._fid.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            if self._fid is not None:
+                self._fid.close()
+                self._fid = None
+
+
+class Instrumentation:
+    """
+    Collects a LatencyHistogram per operation.
+    :param sink: optional callable taking a dict. Called for every recorded call.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, nbytes=0, **extra):
+        with self._lock:
+            histogram = self._histograms.get(operation)
+            if histogram is None:
+                histogram = self._histograms[operation] = LatencyHistogram()
+            histogram.add(seconds, nbytes)
+        if self.sink:
+            record = dict(time=datetime.datetime.now().isoformat(), operation=operation, seconds=seconds)
+            if nbytes:
+                record['bytes'] = nbytes
+            record.update(extra)
+            try:
+                self.sink(record)
+            except Exception:
+                logger.exception('Error in instrumentation sink')
+
+    def snapshot(self):
+        """Returns a dict with operation as key and the summary of its histogram as value."""
+        with self._lock:
+            return {operation: histogram.summary() for operation, histogram in sorted(self._histograms.items())}
+
+    def export(self, sink=None):
+        """Sends a summary record per operation to sink (defaults to the sink given at init)."""
+        sink = sink or self.sink
+        if not sink:
+            raise ValueError('No sink to export to')
+        now = datetime.datetime.now().isoformat()
+        for operation, summary in self.snapshot().items():
+            sink(dict(time=now, operation=operation, summary=summary))
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+def enable(sink=None, path=None):
+    """
+    Enables instrumentation and returns the Instrumentation object.
+    :param sink: callable taking a dict. Receives one record per call.
+    :param path: JSON lines file used as sink if sink is not given
+    """
+    global _instrumentation
+    if sink is None and path:
+        sink = JsonLinesSink(path)
+    _instrumentation = Instrumentation(sink=sink)
+    return _instrumentation
+
+
+def disable():
+    global _instrumentation
+    instrumentation, _instrumentation = _instrumentation, None
+    if instrumentation and hasattr(instrumentation.sink, 'close'):
+        instrumentation.sink.close()
+
+
+def get_instrumentation():
+    """Returns the Instrumentation object or None if instrumentation is disabled."""
+    return _instrumentation
+
+
+def timed(operation):
+    """Decorator recording the latency of each call as operation."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            instrumentation = _instrumentation
+            if instrumentation is None:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                instrumentation.record(operation, time.perf_counter() - t0)
+        return wrapper
+    return decorator
+
+
+class _Measurement:
+    def __init__(self, instrumentation, operation, nbytes):
+        self._instrumentation = instrumentation
+        self.operation = operation
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._instrumentation.record(self.operation, time.perf_counter() - self._t0, self.nbytes)
+        return False
+
+
+class _NoMeasurement:
+    def add_bytes(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NO_MEASUREMENT = _NoMeasurement()
+
+
+def measure(operation, nbytes=0):
+    """
+    Context manager recording the latency of a block as operation. I/O bytes can be given here or added with
+    add_bytes on the returned object.
+    """
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        return _NO_MEASUREMENT
+    return _Measurement(instrumentation, operation, nbytes)
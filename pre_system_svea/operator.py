@@ -1,11 +1,11 @@
 
-from pre_system_svea.resource import Resources
+from pre_system_svea.resource import get_resources
 from pre_system_svea import utils
 
 
 class Operators:
     def __init__(self, root_directory=None):
-        self._resources = Resources(root_directory=root_directory)
+        self._resources = get_resources(root_directory=root_directory)
         self.file_path = self._resources.operator_file
 
         self._data = {}
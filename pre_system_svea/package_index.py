@@ -0,0 +1,186 @@
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from pre_system_svea import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Directory mtime resolution on FAT and some network shares is two seconds. A directory changed within this
+# time from the last check is listed again even if the mtime looks the same.
+MTIME_RESOLUTION = 2.
+
+
+def _get_package_collection_for_directory(directory):
+    import file_explorer
+    return file_explorer.get_package_collection_for_directory(directory)
+
+
+class _DirectoryWatcher:
+    """Marks a PackageIndex as changed on filesystem events. Requires the optional package watchdog."""
+
+    def __init__(self, directory, on_change):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Files growing during a cast do not change the packages
+                if event.event_type != 'modified':
+                    on_change()
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), str(directory), recursive=False)
+        self._observer.daemon = True
+        self._observer.start()
+
+    def stop(self):
+        self._observer.stop()
+
+
+class PackageIndex:
+    """
+    Long lived index of the packages (file_explorer package collection) in one directory.
+
+    The directory is only scanned and the collection only rebuilt when files have been added, removed or
+    renamed. Changes are picked up from filesystem events if watchdog is installed, otherwise by checking the
+    directory mtime (one stat) and, if it has changed, comparing the file listing with the previous one.
+    Queries between changes are answered from the collection in memory.
+
+    For directories on a network share a ServerDirectoryScanner is given instead. Listings and rebuilds then
+    run in the scanner thread pool and never block longer than the scanner timeout. If the share is slow or
+    unreachable the last collection is used and stale is set to True.
+    """
+
+    def __init__(self, directory, watch=True, scanner=None):
+        self.directory = Path(directory)
+        self.stale = False
+        self._lock = threading.RLock()
+        self._pack_col = None
+        self._file_names = None
+        self._dir_mtime = None
+        self._checked_time = 0.
+        self._changed = threading.Event()
+        self._watcher = None
+        self._scanner = scanner
+        self._pending = None
+        self._pending_file_names = None
+        if watch and not scanner:
+            self._start_watcher()
+
+    def _start_watcher(self):
+        if not self.directory.is_dir():
+            return
+        try:
+            self._watcher = _DirectoryWatcher(self.directory, self._changed.set)
+        except ImportError:
+            logger.debug('watchdog not installed. Using mtime check for package index.')
+        except Exception as e:
+            logger.warning(f'Could not watch directory {self.directory}: {e}')
+
+    def close(self):
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+
+    def _list_file_names(self):
+        try:
+            with os.scandir(self.directory) as it:
+                return frozenset(entry.name for entry in it if entry.is_file())
+        except FileNotFoundError:
+            return frozenset()
+
+    def _get_dir_mtime(self):
+        try:
+            return self.directory.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _has_changed(self):
+        if self._file_names is None:
+            return True
+        if self._watcher:
+            return self._changed.is_set()
+        checked_time = time.time()
+        dir_mtime = self._get_dir_mtime()
+        if dir_mtime == self._dir_mtime and (dir_mtime is None or self._checked_time - dir_mtime > MTIME_RESOLUTION):
+            return False
+        if self._list_file_names() != self._file_names:
+            return True
+        self._dir_mtime = dir_mtime
+        self._checked_time = checked_time
+        return False
+
+    def refresh(self, force=False):
+        """Rebuilds the package collection if the directory content has changed (or if force is True)."""
+        with self._lock:
+            if self._scanner:
+                return self._refresh_from_scanner(force)
+            if not force and not self._has_changed():
+                return False
+            self._changed.clear()
+            checked_time = time.time()
+            dir_mtime = self._get_dir_mtime()
+            file_names = self._list_file_names()
+            logger.debug(f'Building package collection for {self.directory} ({len(file_names)} files)')
+            try:
+                with instrumentation.measure('package_index.build'):
+                    self._pack_col = _get_package_collection_for_directory(self.directory)
+            except BaseException:
+                # Built again on the next query
+                self._changed.set()
+                raise
+            # The listing is only kept when the collection matches it
+            self._checked_time = checked_time
+            self._dir_mtime = dir_mtime
+            self._file_names = file_names
+            return True
+
+    def _refresh_from_scanner(self, force):
+        listing = self._scanner.list_directory(self.directory)
+        self.stale = listing.stale
+        if self._pack_col is not None and not self._pending:
+            if listing.stale or (not force and listing.file_names == self._file_names):
+                return False
+        if self._pending is None:
+            self._pending = self._scanner.submit(_get_package_collection_for_directory, self.directory)
+            self._pending_file_names = listing.file_names
+        try:
+            pack_col = self._pending.result(timeout=self._scanner.timeout)
+        except concurrent.futures.TimeoutError:
+            if self._pack_col is None:
+                raise TimeoutError(f'Timeout reading packages in {self.directory}')
+        except Exception:
+            # A failed build is not kept: the next query submits a new one
+            self._pending = None
+            if self._pack_col is None:
+                raise
+        else:
+            self._pack_col = pack_col
+            self._file_names = self._pending_file_names
+            self._pending = None
+            return True
+        logger.warning(f'Using stale package collection for {self.directory}')
+        self.stale = True
+        return False
+
+    @property
+    def package_collection(self):
+        with self._lock:
+            self.refresh()
+            return self._pack_col
+
+    def series_exists(self, **kwargs):
+        return self.package_collection.series_exists(**kwargs)
+
+    def get_latest_serno(self, **kwargs):
+        return self.package_collection.get_latest_serno(**kwargs)
+
+    def get_latest_series(self, **kwargs):
+        return self.package_collection.get_latest_series(**kwargs)
+
+    def get_next_serno(self, **kwargs):
+        return self.package_collection.get_next_serno(**kwargs)
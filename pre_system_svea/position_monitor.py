@@ -0,0 +1,287 @@
+"""
+Streaming position monitor. Reads position fixes from an NMEA sentence stream (file, socket or any iterable of
+lines) and keeps track of the closest station.
+
+Most fixes are answered without a search over the whole station list: after a search the closest few stations
+(candidates) are kept together with the distance to the first station outside the candidates. As long as the
+vessel has moved less than that margin, the closest station must be one of the candidates.
+
+Station changes use hysteresis so that a position between two stations does not make the station flicker.
+Callbacks are only called when the station or its acceptability changes.
+"""
+import collections
+import datetime
+import logging
+import math
+import threading
+import time
+from pathlib import Path
+
+from pre_system_svea.coordinates import decmin_to_decdeg
+from pre_system_svea.station_index import EARTH_RADIUS
+
+logger = logging.getLogger(__name__)
+
+PositionFix = collections.namedtuple('PositionFix', ['time', 'lat', 'lon'])
+
+
+def _checksum_ok(sentence, require_checksum=True):
+    if '*' not in sentence:
+        return not require_checksum
+    data, checksum = sentence[1:].rsplit('*', 1)
+    value = 0
+    for char in data:
+        value ^= ord(char)
+    try:
+        return value == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def _parse_time(value):
+    if len(value) < 6:
+        return None
+    try:
+        seconds = float(value[4:])
+        return datetime.time(int(value[:2]), int(value[2:4]), int(seconds), int(round(seconds % 1 * 1e6)) % 1000000)
+    except ValueError:
+        return None
+
+
+def _parse_position(value, hemisphere, max_degrees):
+    """
+    NMEA positions are given as (d)ddmm.mmmm, the same format as LAT_DM/LONG_DM in the station list.
+    Returns None for garbled positions (not a number, minutes >= 60 or out of range).
+    """
+    if not value:
+        return None
+    pos = float(value)
+    if math.isnan(decmin_to_decdeg(pos, errors='coerce')) or pos > max_degrees * 100:
+        return None
+    if hemisphere in ('S', 'W'):
+        pos = -pos
+    return pos
+
+
+def parse_nmea(sentence, require_checksum=True):
+    """
+    Returns a PositionFix (time as datetime.time, lat/lon in DDMM.mm) for GGA and RMC sentences with a valid fix.
+    Returns None for other sentences, sentences without a fix, sentences with a missing or bad checksum and
+    sentences with an invalid position.
+    :param require_checksum: if False, sentences without checksum are accepted
+    """
+    if isinstance(sentence, bytes):
+        sentence = sentence.decode('ascii', errors='ignore')
+    sentence = sentence.strip()
+    if not sentence.startswith('$') or not _checksum_ok(sentence, require_checksum):
+        return None
+    fields = sentence.split('*')[0].split(',')
+    sentence_type = fields[0][3:]
+    try:
+        if sentence_type == 'GGA' and len(fields) > 6:
+            if fields[6] in ('', '0'):
+                return None
+            lat = _parse_position(fields[2], fields[3], 90)
+            lon = _parse_position(fields[4], fields[5], 180)
+        elif sentence_type == 'RMC' and len(fields) > 6:
+            if fields[2] != 'A':
+                return None
+            lat = _parse_position(fields[3], fields[4], 90)
+            lon = _parse_position(fields[5], fields[6], 180)
+        else:
+            return None
+    except ValueError:
+        return None
+    if lat is None or lon is None:
+        return None
+    return PositionFix(_parse_time(fields[1]), lat, lon)
+
+
+def iter_lines(source):
+    """Yields lines from a file path, an open socket or any iterable of lines (str or bytes)."""
+    if isinstance(source, (str, Path)):
+        with open(source, encoding='ascii', errors='ignore') as fid:
+            yield from fid
+    elif hasattr(source, 'recv'):
+        with source.makefile('r', encoding='ascii', errors='ignore') as fid:
+            yield from fid
+    else:
+        yield from source
+
+
+def _moved_distance(pos1, pos2):
+    """Haversine distance in meters between two positions (LAT_DM, LONG_DM). Accurate also for short distances."""
+    lat1, lon1 = (math.radians(decmin_to_decdeg(value)) for value in pos1)
+    lat2, lon2 = (math.radians(decmin_to_decdeg(value)) for value in pos2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1., math.sqrt(a)))
+
+
+def _seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1e6
+
+
+def iter_fixes(source, speed=None, sleep=time.sleep):
+    """
+    Yields PositionFix from an NMEA source (see iter_lines).
+    :param speed: if given, the fixes are replayed in (NMEA) time scaled with speed, e.g. speed=60 replays an
+                  hour long recording in a minute. Fixes are yielded as fast as possible if None.
+    :param sleep: function used to wait between fixes when replaying
+    """
+    previous = None
+    for line in iter_lines(source):
+        fix = parse_nmea(line)
+        if fix is None:
+            continue
+        if speed and fix.time is not None:
+            if previous is not None:
+                delta = _seconds(fix.time) - _seconds(previous)
+                if delta < 0:
+                    delta += 24 * 3600
+                if delta > 0:
+                    sleep(delta / speed)
+            previous = fix.time
+        yield fix
+
+
+class PositionMonitor:
+    """
+    Keeps track of the closest station for a stream of positions.
+
+    The reported station changes when another station is more than hysteresis meters closer than the reported
+    one. A position becomes acceptable within OUT_OF_BOUNDS_RADIUS of the station and stops being acceptable
+    more than hysteresis meters outside of it.
+
+    station_changed is set (and the callbacks called) every time the station or acceptability changes. current
+    holds the station_info from the last change and distance the distance to that station from the last fix.
+    searches and updates count the searches over the whole station list and the number of processed fixes.
+    """
+
+    def __init__(self, stations, hysteresis=100, candidates=8):
+        """
+        :param stations: Stations or StationFile object
+        :param hysteresis: hysteresis in meters for station and acceptability changes
+        :param candidates: number of stations kept between searches
+        """
+        self.stations = stations
+        self.hysteresis = hysteresis
+        self.candidates = candidates
+        self.station_changed = threading.Event()
+        self.current = None
+        self.distance = None
+        self.searches = 0
+        self.updates = 0
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._data = None
+        self._anchor = None
+        self._candidate_indices = None
+        self._outer_distance = None
+        self._station_index = None
+        self._acceptable = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def add_callback(self, callback):
+        """callback(station_info) is called on station or acceptability changes. See update for station_info."""
+        self._callbacks.append(callback)
+
+    def _search(self, data, lat, lon):
+        self.searches += 1
+        indices, distances = data.index.nearest_k(lat, lon, self.candidates + 1)
+        self._data = data
+        self._anchor = (lat, lon)
+        self._candidate_indices = indices[:self.candidates]
+        if len(indices) > self.candidates:
+            self._outer_distance = distances[-1]
+        else:
+            self._outer_distance = float('inf')
+        return int(indices[0]), int(distances[0])
+
+    def _nearest(self, data, lat, lon):
+        if data is not self._data or self._anchor is None:
+            return self._search(data, lat, lon)
+        # The candidate distances are rounded to meters, hence the margin
+        moved = _moved_distance(self._anchor, (lat, lon)) + 1
+        distances = data.index.distances_to(self._candidate_indices, lat, lon)
+        best = min(range(len(distances)), key=lambda i: (distances[i], self._candidate_indices[i]))
+        if distances[best] + 1 < self._outer_distance - moved:
+            return int(self._candidate_indices[best]), int(distances[best])
+        return self._search(data, lat, lon)
+
+    def update(self, lat, lon, fix_time=None):
+        """
+        Updates the monitor with a new position (LAT_DM, LONG_DM). Returns station_info (a StationRecord as from
+        Stations.get_station_info with distance, acceptable, position_lat, position_lon and time added) if the
+        station or acceptability changed, otherwise None.
+        """
+        with self._lock:
+            self.updates += 1
+            data = self.stations.station_data
+            if data is not self._data:
+                self._station_index = None
+            index, distance = self._nearest(data, lat, lon)
+            reported = self._station_index
+            if reported is None:
+                reported = index
+            elif index != reported:
+                reported_distance = int(data.index.distance(reported, lat, lon))
+                if distance < reported_distance - self.hysteresis:
+                    reported = index
+                else:
+                    distance = reported_distance
+            radius = data.index.radius[reported]
+            if reported == self._station_index and self._acceptable:
+                acceptable = distance <= radius + self.hysteresis
+            else:
+                acceptable = distance <= radius
+            station_name = data.store.value('STATION_NAME', reported)
+            changed = (self.current is None or station_name != self.current['station']
+                       or acceptable != self.current['acceptable'])
+            self._station_index = reported
+            self._acceptable = acceptable
+            self.distance = distance
+            if not changed:
+                return None
+            station_info = data.store.record(reported, distance=distance, acceptable=acceptable, position_lat=lat,
+                                             position_lon=lon, time=fix_time)
+            self.current = station_info
+        logger.info(f'Closest station: {station_name} ({distance} m, acceptable={acceptable})')
+        self.station_changed.set()
+        for callback in self._callbacks:
+            try:
+                callback(station_info)
+            except Exception:
+                logger.exception('Error in position monitor callback')
+        return station_info
+
+    def run(self, source, speed=None):
+        """Consumes an NMEA source (see iter_fixes) until it ends or stop is called."""
+        self._stop.clear()
+        for fix in iter_fixes(source, speed=speed, sleep=self._stop.wait):
+            if self._stop.is_set():
+                break
+            try:
+                self.update(fix.lat, fix.lon, fix_time=fix.time)
+            except ValueError as e:
+                # One bad fix must not stop the monitor
+                logger.warning(f'Skipping position {fix.lat}, {fix.lon}: {e}')
+
+    def start(self, source, speed=None):
+        """Runs the monitor on source in a daemon thread."""
+        self._thread = threading.Thread(target=self._run, args=(source, speed), daemon=True,
+                                        name='position_monitor')
+        self._thread.start()
+        return self._thread
+
+    def _run(self, source, speed):
+        try:
+            self.run(source, speed=speed)
+        except Exception:
+            logger.exception('Position monitor stopped')
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
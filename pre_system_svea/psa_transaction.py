@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+
+from pre_system_svea import instrumentation
+
+
+def _is_unchanged(psa_obj, key, value):
+    try:
+        current = getattr(psa_obj, key)
+        if current == value:
+            return True
+    except Exception:
+        return False
+    if isinstance(value, (str, Path)) and isinstance(current, (str, Path)):
+        return str(current) == str(value)
+    return False
+
+
+class PSATransaction:
+    """
+    Collects changes to a Seasave PSA file and applies them with a single parse and at most one write.
+    Fields are set as attributes, as on file_explorer.psa.SeasavePSAfile:
+
+        with PSATransaction(load_psa) as psa_obj:
+            psa_obj.station = 'BY5 BORNHOLMSDJ'
+            psa_obj.operator = 'MW'
+
+    The PSA file is parsed (once) when the transaction is committed, or earlier if a field not set in the
+    transaction is read. Fields that already have the given value are skipped, and the file is only saved if
+    something has changed. Nothing is written if the with block raises.
+    """
+
+    def __init__(self, load_psa, file_path=None):
+        """
+        :param load_psa: callable returning the SeasavePSAfile object for the PSA file
+        :param file_path: path to the PSA file. Only used to record the number of bytes written.
+        """
+        self.__dict__['_load_psa'] = load_psa
+        self.__dict__['_file_path'] = file_path
+        self.__dict__['_psa_obj'] = None
+        self.__dict__['_changes'] = {}
+        self.__dict__['written'] = False
+
+    def __setattr__(self, key, value):
+        self._changes[key] = value
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        if key in self._changes:
+            return self._changes[key]
+        return getattr(self._get_psa_object(), key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def _get_psa_object(self):
+        if self._psa_obj is None:
+            self.__dict__['_psa_obj'] = self._load_psa()
+        return self._psa_obj
+
+    @property
+    def changes(self):
+        return dict(self._changes)
+
+    def commit(self):
+        """
+        Applies the collected changes and saves the PSA file if anything has changed.
+        :return: True if the file was written
+        """
+        if not self._changes:
+            return False
+        psa_obj = self._get_psa_object()
+        changed = False
+        for key, value in self._changes.items():
+            if _is_unchanged(psa_obj, key, value):
+                continue
+            setattr(psa_obj, key, value)
+            changed = True
+        if changed:
+            with instrumentation.measure('psa.write') as measurement:
+                psa_obj.save()
+                if self._file_path:
+                    measurement.add_bytes(os.path.getsize(self._file_path))
+        self.__dict__['written'] = changed
+        self._changes.clear()
+        return changed
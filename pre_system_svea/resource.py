@@ -1,6 +1,38 @@
+import logging
+import threading
 from pathlib import Path
 import yaml
 
+from pre_system_svea import instrumentation
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_SETTINGS_FILE_PATH = Path(Path(__file__).parent, 'resources', 'resources.yaml')
+
+_shared_resources = {}
+_shared_resources_lock = threading.Lock()
+
+
+def get_resources(root_directory=None):
+    """
+    Returns a Resources object for root_directory that is shared within the process.
+    resources.yaml is parsed and the paths are resolved once and again only if resources.yaml has changed.
+    """
+    key = str(Path(root_directory).resolve()) if root_directory else None
+    mtime = RESOURCE_SETTINGS_FILE_PATH.stat().st_mtime_ns
+    with _shared_resources_lock:
+        cached = _shared_resources.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        resources = Resources(root_directory=root_directory)
+        _shared_resources[key] = (mtime, resources)
+        return resources
+
+
+def clear_resources_cache():
+    with _shared_resources_lock:
+        _shared_resources.clear()
+
 
 class Resources:
     def __init__(self, root_directory=None):
@@ -9,7 +41,7 @@ class Resources:
         else:
             self.root_directory = Path(Path(__file__).parent, 'resources')
 
-        self.resource_settings_file_path = Path(Path(__file__).parent, 'resources', 'resources.yaml')
+        self.resource_settings_file_path = RESOURCE_SETTINGS_FILE_PATH
 
         self.operator_file = None
         self.operator_file_encoding = None
@@ -29,11 +61,13 @@ class Resources:
         self._save_paths()
 
     def _load_resources(self):
-        with open(self.resource_settings_file_path, 'r') as fid:
+        nbytes = self.resource_settings_file_path.stat().st_size
+        with instrumentation.measure('resources.load', nbytes=nbytes), \
+                open(self.resource_settings_file_path, 'r') as fid:
             try:
                 self._config = yaml.safe_load(fid)
             except yaml.YAMLError as exc:
-                print(exc)
+                logger.error(exc)
 
     def _get_path(self, *args, must_exist=True):
         item = self._config
@@ -0,0 +1,121 @@
+import logging
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SeasaveSupervisor:
+    """
+    Starts Seasave and keeps track of it.
+
+    The process started here is tracked through its Popen handle, so checking if it is running costs nothing.
+    Instances started outside the pre-system are found with a process scan filtered on the program name, and
+    the result of the scan is cached for scan_ttl seconds. start always scans again.
+
+    started is set when Seasave has been started and exited when it has exited (returncode then holds the exit
+    status). Callbacks added with add_start_callback/add_exit_callback are called from the supervisor thread.
+    """
+    process_name = 'Seasave.exe'
+
+    def __init__(self, scan_ttl=5.):
+        self.scan_ttl = scan_ttl
+        self.started = threading.Event()
+        self.exited = threading.Event()
+        self.returncode = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._start_callbacks = []
+        self._exit_callbacks = []
+        self._scan_time = None
+        self._scan_result = False
+
+    @property
+    def pid(self):
+        if self._process is None:
+            return None
+        return self._process.pid
+
+    def add_start_callback(self, callback):
+        """callback(pid) is called when Seasave has been started."""
+        self._start_callbacks.append(callback)
+
+    def add_exit_callback(self, callback):
+        """callback(returncode) is called when the Seasave process started here has exited."""
+        self._exit_callbacks.append(callback)
+
+    def is_running(self, max_age=None):
+        """
+        Returns True if Seasave is running, started here or elsewhere.
+        :param max_age: max age in seconds of a cached process scan. Defaults to scan_ttl
+        """
+        if self._process is not None and self._process.poll() is None:
+            return True
+        return self._external_instance_running(max_age=max_age)
+
+    def _external_instance_running(self, max_age=None):
+        if max_age is None:
+            max_age = self.scan_ttl
+        now = time.monotonic()
+        if self._scan_time is not None and now - self._scan_time < max_age:
+            return self._scan_result
+        import psutil
+        name = self.process_name.lower()
+        running = False
+        for p in psutil.process_iter(['name']):
+            if (p.info.get('name') or '').lower() == name:
+                running = True
+                break
+        self._scan_time = now
+        self._scan_result = running
+        return running
+
+    def start(self, program_path, psa_file_path):
+        """
+        Starts Seasave with the given psa file. Raises ChildProcessError if Seasave is already running.
+        """
+        with self._lock:
+            # Not from the cache: an instance started elsewhere since the last scan must not get a second one
+            if self.is_running(max_age=0):
+                raise ChildProcessError('Seasave is already running!')
+            self._process = subprocess.Popen([str(program_path), f'-p={psa_file_path}'])
+            self.returncode = None
+            self.exited.clear()
+            self.started.set()
+            # A process started here is known from its handle
+            self._scan_time = None
+        logger.info(f'Seasave started with pid {self._process.pid}')
+        for callback in self._start_callbacks:
+            self._call(callback, self._process.pid)
+        t = threading.Thread(target=self._wait_for_exit, args=(self._process,))
+        t.daemon = True  # close pipe if GUI process exits
+        t.start()
+        return self._process.pid
+
+    def _wait_for_exit(self, process):
+        returncode = process.wait()
+        with self._lock:
+            if process is not self._process:
+                return
+            self.returncode = returncode
+            self.started.clear()
+            self.exited.set()
+        logger.info(f'Seasave exited with status {returncode}')
+        for callback in self._exit_callbacks:
+            self._call(callback, returncode)
+
+    @staticmethod
+    def _call(callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception('Error in Seasave callback')
+
+    def wait(self, timeout=None):
+        """Waits for the Seasave process started here to exit. Returns the exit status or None on timeout."""
+        if self._process is None:
+            return None
+        if not self.exited.wait(timeout):
+            return None
+        return self.returncode
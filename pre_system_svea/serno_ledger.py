@@ -0,0 +1,466 @@
+"""
+Persistent ledger of used and reserved serial numbers (serno) per year, ship and cruise.
+
+The ledger is a JSON file shared by all processes on the machine (and by all directories it covers: local
+raw, local source and server raw). Every read or change is done under a file lock, so two preparations can
+not get the same serno: reserve hands out the next free serno and records it as reserved until the package
+shows up in one of the directories, the reservation expires or the process that made it is no longer running
+(checked for processes on the same host).
+
+The used sernos are taken from the file names of the .hex files. A directory is only listed again when its
+mtime has changed, so answering next_serno or reserve does not depend on the number of packages. Server
+directories are listed through a ServerDirectoryScanner and never block longer than its timeout.
+"""
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from pre_system_svea import instrumentation
+from pre_system_svea.package_index import MTIME_RESOLUTION
+from pre_system_svea.server_listing import get_directory_mtime, list_file_names
+
+logger = logging.getLogger(__name__)
+
+LEDGER_VERSION = 1
+
+# sbe09_1387_20200207_0801_77SE_01_0120[_tail].hex as created by Controller.get_data_file_path
+FILE_NAME_PATTERN = re.compile(r'^[^_]+_[^_]+_(?P<year>\d{4})\d{4}_\d{4}_(?P<ship>[^_]+)_(?P<cruise>\d+)_'
+                               r'(?P<serno>\d{4})(_.*)?\.hex$', re.IGNORECASE)
+
+
+def parse_file_name(file_name):
+    """Returns (key, serno) for a raw data file name, None if the name is not a package .hex file."""
+    match = FILE_NAME_PATTERN.match(file_name)
+    if not match:
+        return None
+    return get_key(match['year'], match['ship'], match['cruise']), int(match['serno'])
+
+
+def get_key(year, ship, cruise):
+    return f'{year}_{str(ship).upper()}_{str(cruise).zfill(2)}'
+
+
+def format_serno(serno):
+    return str(serno).zfill(4)
+
+
+def _is_unchanged(checked, mtime):
+    # Same check as in PackageIndex: a directory changed within MTIME_RESOLUTION of the last check is listed again
+    return bool(checked) and checked['mtime'] == mtime and checked['checked_time'] - mtime > MTIME_RESOLUTION
+
+
+def _to_ranges(numbers):
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
+
+
+def _from_ranges(ranges):
+    return {number for start, stop in ranges for number in range(start, stop + 1)}
+
+
+def _process_exists(pid):
+    import psutil
+    return psutil.pid_exists(pid)
+
+
+class FileLock:
+    """
+    Exclusive lock between processes on a lock file (fcntl on posix, msvcrt on Windows).
+    Raises TimeoutError if the lock could not be taken within timeout seconds.
+    """
+
+    def __init__(self, path, timeout=10., poll_interval=0.05):
+        self.path = Path(path)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fid = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self):
+        fid = open(self.path, 'a+')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                _lock_file(fid)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    fid.close()
+                    raise TimeoutError(f'Could not lock {self.path} within {self.timeout} s')
+                time.sleep(self.poll_interval)
+        self._fid = fid
+
+    def release(self):
+        fid, self._fid = self._fid, None
+        if fid is None:
+            return
+        try:
+            _unlock_file(fid)
+        finally:
+            fid.close()
+
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(fid):
+        fid.seek(0)
+        msvcrt.locking(fid.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock_file(fid):
+        fid.seek(0)
+        msvcrt.locking(fid.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(fid):
+        fcntl.flock(fid.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock_file(fid):
+        fcntl.flock(fid.fileno(), fcntl.LOCK_UN)
+
+
+class SernoLedger:
+    """
+    Hands out and reserves serial numbers. See the module docstring.
+
+    A reservation belongs to an owner (default host:pid). An owner has at most one reservation per
+    year/ship/cruise and reserving again returns the same serno. With the default owner the host and pid are
+    stored with the reservation, and reservations made by processes on this host that are no longer running are
+    dropped. A given owner is stable across restarts and keeps its reservations until they expire.
+    """
+
+    def __init__(self, path, directories=(), server_directories=(), scanner=None, owner=None,
+                 reservation_ttl=12 * 3600., lock_timeout=10.):
+        """
+        :param path: path to the ledger file. The lock file is created next to it.
+        :param directories: local directories with raw data files
+        :param server_directories: directories on the server, listed through scanner
+        :param scanner: server_listing.ServerDirectoryScanner. Required if server_directories are given
+        :param owner: owner of the reservations made through this ledger. Defaults to host:pid
+        :param reservation_ttl: seconds after which a reservation not yet used is dropped
+        :param lock_timeout: max seconds to wait for another process holding the ledger
+        """
+        self.path = Path(path)
+        self.directories = [str(Path(directory)) for directory in directories]
+        self.server_directories = [str(Path(directory)) for directory in server_directories]
+        self.host = socket.gethostname()
+        self.owner = owner or f'{self.host}:{os.getpid()}'
+        self._pid = None if owner else os.getpid()
+        self.reservation_ttl = reservation_ttl
+        self._scanner = scanner
+        self._file_lock = FileLock(Path(self.path.parent, f'{self.path.name}.lock'), timeout=lock_timeout)
+        self._lock = threading.RLock()
+        self._file_stat = None
+        self._file_checked_time = None
+        self._content = None
+        self._server_retry_time = {}
+        self._clear()
+
+    def _clear(self):
+        self._used = {}
+        self._used_ranges = {}
+        self._max_used = {}
+        self._reserved = {}
+        self._checked = {}
+        self._file_names = {}
+
+    def next_serno(self, year, ship, cruise):
+        """
+        Returns the next serno (as a string) without reserving it. If the owner has a reservation for
+        year/ship/cruise that serno is returned.
+        """
+        with self._transaction():
+            key = get_key(year, ship, cruise)
+            serno = self._get_own_reservation(key)
+            return format_serno(serno if serno is not None else self._get_next(key))
+
+    def reserve(self, year, ship, cruise, serno=None):
+        """
+        Reserves serno (or the next free serno) for year/ship/cruise and returns it as a string.
+        Raises ValueError if serno is already used or reserved by another owner.
+        """
+        with self._transaction() as changed:
+            key = get_key(year, ship, cruise)
+            own = self._get_own_reservation(key)
+            if serno is None:
+                serno = own if own is not None else self._get_next(key)
+            else:
+                serno = int(serno)
+                if serno in self._used.get(key, ()):
+                    raise ValueError(f'Serno {format_serno(serno)} is already used for {key}')
+                reservation = self._reserved.get(key, {}).get(serno)
+                if reservation and reservation['owner'] != self.owner:
+                    raise ValueError(f'Serno {format_serno(serno)} for {key} is reserved by {reservation["owner"]}')
+            if serno != own:
+                reservations = self._reserved.setdefault(key, {})
+                if own is not None:
+                    del reservations[own]
+                reservations[serno] = dict(owner=self.owner, time=time.time(), host=self.host, pid=self._pid)
+                changed.append(key)
+            return format_serno(serno)
+
+    def release(self, year, ship, cruise):
+        """Drops the reservation of the owner for year/ship/cruise."""
+        with self._transaction() as changed:
+            key = get_key(year, ship, cruise)
+            own = self._get_own_reservation(key)
+            if own is not None:
+                del self._reserved[key][own]
+                changed.append(key)
+
+    def is_used(self, year, ship, cruise, serno):
+        """Returns True if there is a package with serno in any of the directories."""
+        with self._transaction():
+            return int(serno) in self._used.get(get_key(year, ship, cruise), ())
+
+    def get_reservations(self, year, ship, cruise):
+        """Returns a dict with serno as key and owner as value."""
+        with self._transaction():
+            return {format_serno(serno): reservation['owner']
+                    for serno, reservation in self._reserved.get(get_key(year, ship, cruise), {}).items()}
+
+    def rebuild(self):
+        """Forgets the used sernos and lists all directories again. Reservations are kept."""
+        with self._transaction() as changed:
+            self._used = {}
+            self._used_ranges = {}
+            self._max_used = {}
+            self._checked = {}
+            self._file_names = {}
+            self._reconcile()
+            changed.append(None)
+
+    def _get_own_reservation(self, key):
+        for serno, reservation in self._reserved.get(key, {}).items():
+            if reservation['owner'] == self.owner:
+                return serno
+        return None
+
+    def _get_next(self, key):
+        reserved = self._reserved.get(key)
+        return max(self._max_used.get(key, 0), max(reserved) if reserved else 0) + 1
+
+    def _transaction(self):
+        return _LedgerTransaction(self)
+
+    def _get_file_stat(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _is_loaded(self, file_stat):
+        # Another process can replace the file within the mtime resolution by one of the same size (and with a
+        # reused inode). The stat is only trusted once it was taken more than MTIME_RESOLUTION after the mtime.
+        return (file_stat is not None and file_stat == self._file_stat and
+                self._file_checked_time - file_stat[0] / 1e9 > MTIME_RESOLUTION)
+
+    def _sync(self):
+        """Loads the ledger if it has been changed by another process and checks the directories."""
+        checked_time = time.time()
+        file_stat = self._get_file_stat()
+        loaded = False
+        if not self._is_loaded(file_stat):
+            content = self._read()
+            # Within the mtime resolution the content is compared, so that a recent own write is not parsed again
+            if content is None or content != self._content:
+                self._load(content)
+                loaded = True
+        self._file_stat = file_stat
+        self._file_checked_time = checked_time
+        reconciled = self._reconcile()
+        expired = self._expire()
+        return reconciled or expired or (loaded and file_stat is None)
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as fid:
+                return fid.read()
+        except FileNotFoundError:
+            return None
+
+    def _load(self, content):
+        self._clear()
+        self._content = content
+        if content is None:
+            return
+        try:
+            data = json.loads(content.decode('utf8'))
+        except ValueError as e:
+            logger.warning(f'Could not read serno ledger {self.path}, rebuilding it: {e}')
+            return
+        if data.get('version') != LEDGER_VERSION:
+            logger.info(f'Serno ledger {self.path} has another version, rebuilding it')
+            return
+        for key, series in data['series'].items():
+            used = _from_ranges(series['used'])
+            self._used[key] = used
+            self._used_ranges[key] = series['used']
+            self._max_used[key] = max(used) if used else 0
+            self._reserved[key] = {int(serno): reservation for serno, reservation in series['reserved'].items()}
+        self._checked = data['directories']
+
+    def _save(self):
+        keys = set(self._used) | set(self._reserved)
+        for key in keys:
+            if key not in self._used_ranges:
+                self._used_ranges[key] = _to_ranges(self._used.get(key, ()))
+        data = dict(version=LEDGER_VERSION,
+                    directories=self._checked,
+                    series={key: dict(used=self._used_ranges[key],
+                                      reserved={format_serno(serno): reservation
+                                                for serno, reservation in self._reserved.get(key, {}).items()})
+                            for key in sorted(keys)})
+        content = json.dumps(data).encode('utf8')
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name)
+        try:
+            with os.fdopen(fd, 'wb') as fid:
+                fid.write(content)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            # The changes in memory are not in the file: loaded again in the next transaction
+            self._file_stat = self._content = None
+            raise
+        self._content = content
+        self._file_checked_time = time.time()
+        self._file_stat = self._get_file_stat()
+
+    def _reconcile(self):
+        """Adds the sernos in directories that have changed since they were last checked. Returns True if any."""
+        changed = False
+        for directory in self.directories:
+            changed |= self._check_directory(directory, self._get_local_listing)
+        for directory in self.server_directories:
+            changed |= self._check_directory(directory, self._get_server_listing)
+        if changed:
+            self._drop_used_reservations()
+        return changed
+
+    def _get_local_listing(self, directory, checked):
+        """Returns (mtime, checked_time, file names). file names is None if the directory has not changed."""
+        checked_time = time.time()
+        try:
+            mtime = get_directory_mtime(directory)
+        except FileNotFoundError:
+            return None, checked_time, None
+        if _is_unchanged(checked, mtime):
+            return mtime, checked['checked_time'], None
+        return mtime, checked_time, list_file_names(directory)
+
+    def _get_server_listing(self, directory, checked):
+        if time.time() < self._server_retry_time.get(directory, 0):
+            return None, None, None
+        listing = self._scanner.list_directory(directory)
+        if listing.error is not None:
+            # Do not wait for an unreachable server on every call. The sernos already known are used meanwhile.
+            self._server_retry_time[directory] = time.time() + self._scanner.ttl
+        if listing.stale and listing.listed_time is None:
+            return None, None, None
+        if _is_unchanged(checked, listing.mtime):
+            return listing.mtime, checked['checked_time'], None
+        return listing.mtime, listing.listed_time, listing.file_names
+
+    def _check_directory(self, directory, get_listing):
+        checked = self._checked.get(directory)
+        mtime, checked_time, file_names = get_listing(directory, checked)
+        if file_names is None:
+            return False
+        with instrumentation.measure('serno_ledger.reconcile'):
+            added = 0
+            # Only names not seen in the last listing of the directory (by this process) are parsed
+            for file_name in file_names - self._file_names.get(directory, frozenset()):
+                parsed = parse_file_name(file_name)
+                if not parsed:
+                    continue
+                key, serno = parsed
+                used = self._used.setdefault(key, set())
+                if serno not in used:
+                    used.add(serno)
+                    self._used_ranges.pop(key, None)
+                    self._max_used[key] = max(self._max_used.get(key, 0), serno)
+                    added += 1
+        self._checked[directory] = dict(mtime=mtime, checked_time=checked_time)
+        self._file_names[directory] = file_names
+        if added:
+            logger.debug(f'{added} new sernos in {directory}')
+        return checked is None or checked['mtime'] != mtime or bool(added)
+
+    def _drop_used_reservations(self):
+        for key, reservations in self._reserved.items():
+            used = self._used.get(key, ())
+            for serno in [serno for serno in reservations if serno in used]:
+                del reservations[serno]
+
+    def _is_abandoned(self, reservation):
+        """True if the reservation was made by a process on this host that is no longer running."""
+        pid = reservation.get('pid')
+        if pid is None or reservation.get('host') != self.host or pid == os.getpid():
+            return False
+        return not _process_exists(pid)
+
+    def _expire(self):
+        expired = time.time() - self.reservation_ttl
+        changed = False
+        for key, reservations in self._reserved.items():
+            for serno, reservation in list(reservations.items()):
+                if reservation['time'] < expired:
+                    logger.info(f'Reservation of serno {format_serno(serno)} for {key} has expired')
+                elif self._is_abandoned(reservation):
+                    logger.info(f'Reservation of serno {format_serno(serno)} for {key} dropped: process '
+                                f'{reservation["pid"]} ({reservation["owner"]}) is no longer running')
+                else:
+                    continue
+                del reservations[serno]
+                changed = True
+        return changed
+
+
+class _LedgerTransaction:
+    """Holds the thread and file lock, syncs the ledger on enter and saves it on exit if it has changed."""
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.changed = []
+
+    def __enter__(self):
+        self.ledger._lock.acquire()
+        try:
+            self.ledger._file_lock.acquire()
+            try:
+                if self.ledger._sync():
+                    self.changed.append(None)
+            except BaseException:
+                self.ledger._file_lock.release()
+                raise
+        except BaseException:
+            self.ledger._lock.release()
+            raise
+        return self.changed
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.changed:
+                self.ledger._save()
+        finally:
+            self.ledger._file_lock.release()
+            self.ledger._lock.release()
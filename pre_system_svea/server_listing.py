@@ -0,0 +1,149 @@
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from pre_system_svea.package_index import MTIME_RESOLUTION
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryListing:
+    """Names of the files in a directory at listed_time. stale is True if the listing could not be renewed."""
+
+    def __init__(self, directory, file_names=frozenset(), mtime=None, listed_time=None, stale=False, error=None):
+        self.directory = directory
+        self.file_names = file_names
+        self.mtime = mtime
+        self.listed_time = listed_time
+        self.stale = stale
+        self.error = error
+
+    def __repr__(self):
+        return f'DirectoryListing({self.directory}, {len(self.file_names)} files, stale={self.stale})'
+
+    @property
+    def age(self):
+        if self.listed_time is None:
+            return None
+        return time.time() - self.listed_time
+
+    def as_stale(self, error=None):
+        return DirectoryListing(self.directory, self.file_names, self.mtime, self.listed_time, stale=True,
+                                error=error)
+
+
+def get_directory_mtime(directory):
+    return os.stat(directory).st_mtime
+
+
+def list_file_names(directory):
+    with os.scandir(directory) as it:
+        return frozenset(entry.name for entry in it if entry.is_file())
+
+
+class ServerDirectoryScanner:
+    """
+    Lists directories on a (slow) network share from a thread pool.
+
+    Listings are cached for ttl seconds. After that the directory mtime is checked and the directory is
+    listed again only if it has changed, or if the last listing was made within MTIME_RESOLUTION of the mtime
+    (a file added in the same mtime tick does not change the mtime). A caller never waits more than timeout seconds: if the share does not
+    answer in time (or not at all) the last known listing is returned with stale=True, and the pending scan
+    updates the cache when it finishes.
+    """
+
+    def __init__(self, ttl=30., timeout=2., max_workers=4, get_mtime=None, list_names=None):
+        """
+        :param ttl: seconds a listing is used without asking the server
+        :param timeout: max seconds to wait for the server before returning a stale listing
+        :param max_workers: number of threads scanning directories
+        :param get_mtime: function returning the mtime of a directory. Defaults to os.stat
+        :param list_names: function returning a frozenset of the file names in a directory. Defaults to os.scandir
+        """
+        self.ttl = ttl
+        self.timeout = timeout
+        self._get_mtime = get_mtime or get_directory_mtime
+        self._list_names = list_names or list_file_names
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='server_listing')
+        self._lock = threading.Lock()
+        self._listings = {}
+        self._pending = {}
+
+    def submit(self, func, *args, **kwargs):
+        """Runs func in the scanner thread pool and returns a Future."""
+        return self._executor.submit(func, *args, **kwargs)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _scan(self, directory, cached):
+        mtime = self._get_mtime(directory)
+        now = time.time()
+        if (cached and not cached.stale and cached.mtime == mtime and
+                cached.listed_time - mtime > MTIME_RESOLUTION):
+            listing = DirectoryListing(directory, cached.file_names, mtime, now)
+        else:
+            listing = DirectoryListing(directory, self._list_names(directory), mtime, now)
+        with self._lock:
+            self._listings[directory] = listing
+        return listing
+
+    def _get_future(self, directory, cached):
+        with self._lock:
+            future = self._pending.get(directory)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._scan, directory, cached)
+            self._pending[directory] = future
+        # Outside the lock: the callback runs right away (and takes the lock) if the scan has already failed
+        future.add_done_callback(lambda f: self._remove_pending(directory, f))
+        return future
+
+    def _remove_pending(self, directory, future):
+        with self._lock:
+            if self._pending.get(directory) is future:
+                del self._pending[directory]
+
+    def _wait(self, directory, future, cached, timeout):
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            logger.warning(f'Timeout listing server directory: {directory}')
+            error = TimeoutError(f'Timeout listing {directory}')
+        except OSError as e:
+            logger.warning(f'Could not list server directory {directory}: {e}')
+            error = e
+        if cached:
+            return cached.as_stale(error)
+        return DirectoryListing(directory, stale=True, error=error)
+
+    def list_directory(self, directory, max_age=None):
+        """
+        Returns a DirectoryListing for directory.
+        :param directory: directory to list
+        :param max_age: max age in seconds of a cached listing. Defaults to ttl
+        """
+        return self.list_directories([directory], max_age=max_age)[str(Path(directory))]
+
+    def list_directories(self, directories, max_age=None):
+        """Lists several directories (e.g. one per year) in parallel. Returns a dict with directory as key."""
+        if max_age is None:
+            max_age = self.ttl
+        futures = {}
+        result = {}
+        for directory in directories:
+            directory = str(Path(directory))
+            with self._lock:
+                cached = self._listings.get(directory)
+            if cached and cached.age < max_age:
+                result[directory] = cached
+                continue
+            futures[directory] = (self._get_future(directory, cached), cached)
+        deadline = time.time() + self.timeout
+        for directory, (future, cached) in futures.items():
+            result[directory] = self._wait(directory, future, cached, max(0., deadline - time.time()))
+        return result
@@ -1,12 +1,12 @@
 
-from pre_system_svea.resource import Resources
+from pre_system_svea.resource import get_resources
 
 
 class Ships:
 
     def __init__(self, root_directory=None):
         self.root_directory = root_directory
-        self._resources = Resources(root_directory=root_directory)
+        self._resources = get_resources(root_directory=root_directory)
         self._code_to_name = {}
         self._name_to_code = {}
         self.all_items = []
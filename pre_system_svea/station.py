@@ -1,8 +1,13 @@
+import threading
 from pathlib import Path
 
-import requests
-
-from pre_system_svea.resource import Resources
+from pre_system_svea import download
+from pre_system_svea import instrumentation
+from pre_system_svea.coordinates import decmin_to_decdeg
+from pre_system_svea import station_cache
+from pre_system_svea.resource import get_resources
+from pre_system_svea.station_index import StationIndex
+from pre_system_svea.station_store import StationStore
 
 import math
 import numpy as np
@@ -17,12 +22,27 @@ class StationMethods:
     def get_closest_station(self, *args, **kwargs):
         raise NotImplementedError
 
+    def get_closest_stations(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_nearest_stations(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_stations_within_radius(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_stations_covering_position(self, *args, **kwargs):
+        raise NotImplementedError
+
     def get_proper_station_name(self, *args, **kwargs):
         raise NotImplementedError
 
     def get_station_info(self, *args, **kwargs):
         raise NotImplementedError
 
+    def get_station_infos(self, *args, **kwargs):
+        raise NotImplementedError
+
     def get_station_list(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -32,11 +52,13 @@ class StationMethods:
 
 class StationsMatprogram(StationMethods):
 
+    @instrumentation.timed('stations.init')
     def __init__(self, root_directory=None, **kwargs):
         self.station_name_list = []
-        self._resources = Resources(root_directory=root_directory)
+        self._update_callbacks = []
+        self._resources = get_resources(root_directory=root_directory)
         # self._station_file = StationFile(self._resources.station_file, encoding=self._resources.s)
-        update_primary = kwargs.get('update_primary')
+        update_primary = kwargs.pop('update_primary', None)
         if update_primary is None:
             update_primary = self._resources.update_primary_station_file
         self._station_file = StationFile(backup_file_path=self._resources.backup_station_file,
@@ -45,23 +67,56 @@ class StationsMatprogram(StationMethods):
                                          backup_encoding=self._resources.backup_station_file_encoding,
                                          **kwargs)
         self._load_station_filter_file()
+        self._station_file.add_update_callback(self._on_station_file_updated)
+        if update_primary:
+            self._station_file.refresh_primary()
 
     def _load_station_filter_file(self):
-        self.station_name_list = []
         with open(self._resources.station_filter_file, encoding='cp1252') as fid:
-            for line in fid:
-                name = line.strip()
-                if not name:
-                    continue
-                if not self._station_file.get_station_info(name):
-                    print(f'Could not find station info for station: {name}')
-                    continue
-                self.station_name_list.append(name)
-        self.station_name_list.sort()
+            names = [line.strip() for line in fid if line.strip()]
+        found, unresolved = self._station_file.get_station_infos(names)
+        for name in unresolved:
+            logger.warning(f'Could not find station info for station: {name}')
+        self.station_name_list = sorted(found)
+
+    def _on_station_file_updated(self):
+        self._load_station_filter_file()
+        for callback in self._update_callbacks:
+            callback()
+
+    @property
+    def station_list_updated(self):
+        return self._station_file.station_list_updated
+
+    @property
+    def station_data(self):
+        return self._station_file.station_data
+
+    def add_update_callback(self, callback):
+        """
+        Adds a callable (without arguments) that is called when an updated station list has been loaded.
+        Note that the callback is called from the background thread doing the update.
+        """
+        self._update_callbacks.append(callback)
+
+    def refresh_primary(self, *args, **kwargs):
+        return self._station_file.refresh_primary(*args, **kwargs)
 
     def get_closest_station(self, *args, **kwargs):
         return self._station_file.get_closest_station(*args, *kwargs)
-    
+
+    def get_closest_stations(self, *args, **kwargs):
+        return self._station_file.get_closest_stations(*args, **kwargs)
+
+    def get_nearest_stations(self, *args, **kwargs):
+        return self._station_file.get_nearest_stations(*args, **kwargs)
+
+    def get_stations_within_radius(self, *args, **kwargs):
+        return self._station_file.get_stations_within_radius(*args, **kwargs)
+
+    def get_stations_covering_position(self, *args, **kwargs):
+        return self._station_file.get_stations_covering_position(*args, **kwargs)
+
     def get_distance_to_station(self, *args, **kwargs):
         return self._station_file.get_distance_to_station(*args, **kwargs)
 
@@ -71,6 +126,9 @@ class StationsMatprogram(StationMethods):
     def get_station_info(self, *args, **kwargs):
         return self._station_file.get_station_info(*args, *kwargs)
 
+    def get_station_infos(self, *args, **kwargs):
+        return self._station_file.get_station_infos(*args, **kwargs)
+
     def get_station_list(self, *args, **kwargs):
         return self.station_name_list
 
@@ -78,7 +136,33 @@ class StationsMatprogram(StationMethods):
         return self.get_position(*args, *kwargs)
 
 
+class StationData:
+    """
+    A loaded station list and the lookup structures built from it. Never changed after creation, so a
+    StationFile can replace its StationData in one assignment while other threads are reading from it.
+    """
+
+    def __init__(self, df, station_col='STATION_NAME', lat_col='LAT_DM', lon_col='LONG_DM', depth_col='WADEP'):
+        self.store = StationStore(df, station_col=station_col, lat_col=lat_col, lon_col=lon_col, depth_col=depth_col)
+        self.index = StationIndex(df[lat_col].values, df[lon_col].values, radius=df['OUT_OF_BOUNDS_RADIUS'].values)
+        self.station_rows = {}
+        for row, name in enumerate(df[station_col]):
+            self.station_rows.setdefault(name, row)
+        self.station_synonyms = {}
+        for name, synonym_string in zip(df[station_col], df['SYNONYM_NAMES'].fillna('').astype(str)):
+            self.station_synonyms[name.upper()] = name
+            synonym_string = synonym_string.strip()
+            if not synonym_string:
+                continue
+            synonyms = synonym_string.split('<or>')
+            for syn in synonyms:
+                self.station_synonyms[syn.upper()] = name
+
+
 class StationFile(StationMethods):
+    required_columns = ['STATION_NAME', 'SYNONYM_NAMES', 'LAT_DM', 'LONG_DM', 'WADEP', 'OUT_OF_BOUNDS_RADIUS',
+                        'MEDIA']
+
     def __init__(self, backup_file_path=None, primary_url=None, **kwargs):
         # primary_url = 'https://raw.githubusercontent.com/sharksmhi/flask_station_app/main/data/station.txt'
         # # primary_url = 'https://github.com/sharksmhi/flask_station_app/blob/main/data/station.txt'
@@ -92,10 +176,10 @@ class StationFile(StationMethods):
         if backup_file_path:
             self._backup_file_path = Path(backup_file_path)
 
-        self._station_synonyms = {}
-
         self._primary_encoding = kwargs.get('primary_encoding', 'cp1252')
         self._backup_encoding = kwargs.get('backup_encoding', 'cp1252')
+        self._download_timeout = kwargs.get('download_timeout', 30)
+        self._download_retries = kwargs.get('download_retries', 3)
 
         # self.lat_col = 'LATITUDE_WGS84_SWEREF99_DD'
         # self.lon_col = 'LONGITUDE_WGS84_SWEREF99_DD'
@@ -104,79 +188,204 @@ class StationFile(StationMethods):
         self.depth_col = 'WADEP'
         self.station_col = 'STATION_NAME'
 
-        self._df = None
-        if kwargs.get('update_primary'):
+        self.station_list_updated = threading.Event()
+        self._update_callbacks = []
+        self._refresh_thread = None
+        self._refresh_lock = threading.Lock()
+
+        self._data = None
+        update_primary = kwargs.get('update_primary')
+        if update_primary and not self._get_file_path_and_encoding()[0]:
+            # No station list to serve while downloading
             self._download_station_file_from_git()
+            update_primary = False
         self._load_file()
+        if update_primary:
+            self.refresh_primary()
+
+    @property
+    def station_data(self):
+        """The current StationData. Replaced (not modified) when the station list is updated."""
+        return self._data
+
+    def add_update_callback(self, callback):
+        """
+        Adds a callable (without arguments) that is called when an updated station list has been loaded.
+        Note that the callback is called from the background thread doing the update.
+        """
+        self._update_callbacks.append(callback)
+
+    def refresh_primary(self, blocking=False):
+        """
+        Updates the primary station file from the primary url. The current station list is used until the new
+        file has been downloaded, validated and indexed. It is then swapped in, station_list_updated is set
+        and the update callbacks are called.
+        :param blocking: If True, wait for the update to finish
+        :return: the thread doing the update
+        """
+        with self._refresh_lock:
+            if not (self._refresh_thread and self._refresh_thread.is_alive()):
+                self._refresh_thread = threading.Thread(target=self._refresh_primary, daemon=True)
+                self._refresh_thread.start()
+            thread = self._refresh_thread
+        if blocking:
+            thread.join()
+        return thread
+
+    def _refresh_primary(self):
+        if not self._download_station_file_from_git():
+            return
+        try:
+            data = self._read_station_data()
+        except Exception as e:
+            logger.warning(f'Could not load updated station file in pre_system_svea: {e}')
+            return
+        self._data = data
+        self.station_list_updated.set()
+        for callback in self._update_callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception('Error in station list update callback')
 
     def _download_station_file_from_git(self):
         if not self._primary_url:
-            return
-        response = requests.get(self._primary_url)
-        logger.debug(f'Setting response encoding to: {self._primary_encoding}')
-        response.encoding = self._primary_encoding
-        with open(self._primary_file_path, 'w', encoding=self._primary_encoding) as fid:
-            fid.write(response.text)
-        logger.info(f'Primary station file updated in pre_system_svea')
+            return False
+        try:
+            return download.download_file(self._primary_url,
+                                          self._primary_file_path,
+                                          validate=self._validate_station_file,
+                                          timeout=self._download_timeout,
+                                          retries=self._download_retries)
+        except Exception as e:
+            logger.warning(f'Could not update primary station file in pre_system_svea: {e}')
+            return False
+
+    def _validate_station_file(self, file_path):
+        with open(file_path, encoding=self._primary_encoding) as fid:
+            header = fid.readline().rstrip('\r\n').split('\t')
+        missing = [col for col in self.required_columns if col not in header]
+        if missing:
+            raise ValueError(f'Missing columns in downloaded station file: {missing}')
+
+    def _get_file_path_and_encoding(self):
+        if self._primary_file_path and self._primary_file_path.exists():
+            return self._primary_file_path, self._primary_encoding
+        elif self._backup_file_path and self._backup_file_path.exists():
+            return self._backup_file_path, self._backup_encoding
+        return None, None
 
     def _load_file(self):
-        print('self._primary_file_path', self._primary_file_path)
-        if self._primary_file_path and self._primary_file_path.exists():
-            file_path = self._primary_file_path
-            encoding = self._primary_encoding
+        self._data = self._read_station_data()
+
+    def _read_station_data(self):
+        file_path, encoding = self._get_file_path_and_encoding()
+        if not file_path:
+            raise FileNotFoundError('Could not find station file in pre_system_svea')
+        if file_path == self._primary_file_path:
             logger.info(f'Using primary station file i pre_system_svea: {file_path}')
-        elif self._backup_file_path and self._backup_file_path.exists():
-            file_path = self._backup_file_path
-            encoding = self._backup_encoding
-            logger.info(f'Using backup station file i pre_system_svea: {file_path}')
         else:
-            raise FileNotFoundError('Could not find station file in pre_system_svea')
-        print('file_path', file_path)
-        self._df = pd.read_csv(file_path, sep='\t', encoding=encoding)
-        self._df['MEDIA'] = self._df['MEDIA'].fillna('')
-        self._df[self.depth_col] = self._df[self.depth_col].fillna('')
-        # self._df = self._df[self._df['MEDIA'].str.contains('Vatten')].reset_index()
-
-    def _create_station_synonyms(self):
-        for name, synonym_string in zip(self._df[self.station_col], self._df['SYNONYM_NAMES'].astype(str)):
-            self._station_synonyms[name.upper()] = name
-            synonym_string = synonym_string.strip()
-            if not synonym_string:
-                continue
-            synonyms = synonym_string.split('<or>')
-            for syn in synonyms:
-                self._station_synonyms[syn.upper()] = name
-
-    def _add_cols_to_station_info(self, station_info):
-        station_info['lat'] = station_info[self.lat_col]
-        station_info['lon'] = station_info[self.lon_col]
-        station_info['depth'] = str(station_info[self.depth_col])
-        station_info['station'] = station_info[self.station_col]
+            logger.info(f'Using backup station file i pre_system_svea: {file_path}')
+        with instrumentation.measure('stations.load', nbytes=file_path.stat().st_size):
+            key = station_cache.get_source_key(file_path)
+            data = station_cache.load(file_path, key)
+            if data is None:
+                with instrumentation.measure('stations.parse'):
+                    data = self._compile_file(file_path, encoding)
+                station_cache.save(file_path, key, data)
+            else:
+                logger.info(f'Using cached station data for: {file_path}')
+        return data
+
+    def _compile_file(self, file_path, encoding):
+        df = pd.read_csv(file_path, sep='\t', encoding=encoding)
+        df['MEDIA'] = df['MEDIA'].fillna('')
+        df[self.depth_col] = df[self.depth_col].fillna('')
+        # df = df[df['MEDIA'].str.contains('Vatten')].reset_index()
+        return StationData(df, station_col=self.station_col, lat_col=self.lat_col, lon_col=self.lon_col,
+                           depth_col=self.depth_col)
+
+    @staticmethod
+    def _get_station_info_with_distance(data, index, distance):
+        radius = data.store.columns['OUT_OF_BOUNDS_RADIUS'].item(index)
+        return data.store.record(index, distance=distance, acceptable=distance <= radius)
+
+    def _get_station_info_list(self, data, indices, distances):
+        return [self._get_station_info_with_distance(data, int(index), int(distance))
+                for index, distance in zip(indices, distances)]
 
     def get_closest_station(self, lat, lon):
         if lat is None or lon is None:
             return None
-        dist = self._df.apply(lambda x: distance_to_station((lat, lon),
-                                                           (x[self.lat_col],
-                                                            x[self.lon_col])), axis=1)
-        min_dist = min(dist)
-        index = np.where(dist == min_dist)
-        # print('LAT', lat)
-        # print('LON', lon)
-        # print('INDEX', index)
-        df = self._df.loc[index[0]]
-        station_info = dict(zip(df.columns, df.values[0]))
-        station_info['distance'] = min_dist
-        station_info['acceptable'] = min_dist <= station_info['OUT_OF_BOUNDS_RADIUS']
-        self._add_cols_to_station_info(station_info)
-        return station_info
-    
+        data = self._data
+        index, min_dist = data.index.nearest(lat, lon)
+        return self._get_station_info_with_distance(data, index, min_dist)
+
+    def get_nearest_stations(self, lat, lon, k=5):
+        """
+        Returns station_info (as in get_closest_station) for the k closest stations, closest first.
+        """
+        if lat is None or lon is None:
+            return []
+        data = self._data
+        return self._get_station_info_list(data, *data.index.nearest_k(lat, lon, k))
+
+    def get_stations_within_radius(self, lat, lon, radius):
+        """
+        Returns station_info (as in get_closest_station) for all stations within radius meters, closest first.
+        """
+        if lat is None or lon is None:
+            return []
+        data = self._data
+        return self._get_station_info_list(data, *data.index.within(lat, lon, radius))
+
+    def get_stations_covering_position(self, lat, lon):
+        """
+        Returns station_info (as in get_closest_station) for all stations whose OUT_OF_BOUNDS_RADIUS covers the
+        position, closest first. All of these are "acceptable".
+        """
+        if lat is None or lon is None:
+            return []
+        data = self._data
+        return self._get_station_info_list(data, *data.index.covering(lat, lon))
+
+    def get_closest_stations(self, lat, lon=None, decimal_degrees=False, lat_col=None, lon_col=None):
+        """
+        Batch version of get_closest_station for whole position tracks.
+        :param lat: array of latitudes or a DataFrame with position columns
+        :param lon: array of longitudes. Not used if lat is a DataFrame
+        :param decimal_degrees: True if positions are given in decimal degrees, else LAT_DM/LONG_DM format
+        :param lat_col: latitude column if lat is a DataFrame. Defaults to LAT_DM
+        :param lon_col: longitude column if lat is a DataFrame. Defaults to LONG_DM
+        :return: dict with arrays "index", "station", "distance" and "acceptable".
+                 Missing positions get index -1, station '', distance NaN and acceptable False.
+        """
+        if isinstance(lat, pd.DataFrame):
+            df = lat
+            lat = df[lat_col or self.lat_col].values
+            lon = df[lon_col or self.lon_col].values
+        lat = pd.to_numeric(np.asarray(lat).ravel(), errors='coerce')
+        lon = pd.to_numeric(np.asarray(lon).ravel(), errors='coerce')
+        data = self._data
+        indices, distances = data.index.nearest_many(lat, lon, decimal_degrees=decimal_degrees)
+        found = indices >= 0
+        stations = np.full(len(indices), '', dtype=object)
+        stations[found] = data.store.columns[self.station_col][indices[found]]
+        acceptable = np.zeros(len(indices), dtype=bool)
+        acceptable[found] = distances[found] <= data.store.columns['OUT_OF_BOUNDS_RADIUS'][indices[found]]
+        return dict(index=indices,
+                    station=stations,
+                    distance=distances,
+                    acceptable=acceptable)
+
     def get_distance_to_station(self, lat, lon, station_name):
-        info = self.get_station_info(station_name)
-        if not info:
-            return
-        dist = distance_to_station([lat, lon], [info['lat'], info['lon']])
-        return dist
+        if lat is None or lon is None:
+            return None
+        data = self._data
+        name = data.station_synonyms.get(station_name.strip().upper())
+        if not name:
+            return None
+        return data.index.distance(data.station_rows[name], lat, lon)
 
     def get_proper_station_name(self, synonym):
         """
@@ -185,20 +394,42 @@ class StationFile(StationMethods):
         :return:
         """
         synonym = synonym.strip().upper()
-        if not self._station_synonyms:
-            self._create_station_synonyms()
-        return self._station_synonyms.get(synonym, None)
+        return self._data.station_synonyms.get(synonym, None)
 
     def get_station_info(self, station_name):
-        name = self.get_proper_station_name(station_name)
+        """
+        Returns station_info for the station (or synonym) as a read only StationRecord mapping with the columns of
+        the station file and lat, lon, depth and station. Use dict(station_info) for a modifiable copy.
+        """
+        data = self._data
+        name = data.station_synonyms.get(station_name.strip().upper())
         if not name:
             return None
-        station_info = self._df.loc[self._df['STATION_NAME'] == name].iloc[0].to_dict()
-        self._add_cols_to_station_info(station_info)
-        return station_info
+        return data.store.record(data.station_rows[name])
+
+    def get_station_infos(self, station_names):
+        """
+        Resolves many station names (or synonyms) at once against the same version of the station list.
+        :param station_names: iterable of names
+        :return: tuple (found, unresolved). found is a dict with the given name as key and station_info (as from
+                 get_station_info) as value, in the given order. unresolved is a list of the names not found.
+        """
+        data = self._data
+        synonyms = data.station_synonyms
+        found = {}
+        unresolved = []
+        for station_name in station_names:
+            if station_name in found:
+                continue
+            name = synonyms.get(station_name.strip().upper())
+            if not name:
+                unresolved.append(station_name)
+                continue
+            found[station_name] = data.store.record(data.station_rows[name])
+        return found, unresolved
 
     def get_station_list(self):
-        return sorted(self._df['STATION_NAME'])
+        return sorted(self._data.store.columns['STATION_NAME'].tolist())
 
     def get_position(self, station_name):
         station_info = self.get_station_info(station_name)
@@ -212,39 +443,6 @@ class Stations(StationsMatprogram):
         super().__init__(*args, **kwargs)
 
 
-def is_sequence(arg):
-    "Checks if an object is iterable (you can loop over it) and not a string"
-    return (not hasattr(arg, "strip") and
-            hasattr(arg, "__iter__"))
-
-def decmin_to_decdeg(pos, return_string=False):
-    try:
-        if is_sequence(pos):
-            output = []
-            for p in pos:
-                p = float(p)
-                if p >= 0:
-                    output.append(np.floor(p / 100.) + (p % 100) / 60.)
-                else:
-                    output.append(np.ceil(p / 100.) - (-p % 100) / 60.)
-        else:
-            pos = float(pos)
-            if pos >= 0:
-                output = np.floor(pos / 100.) + (pos % 100) / 60.
-            else:
-                output = np.ceil(pos / 100.) - (-pos % 100) / 60.
-
-        if return_string:
-            if is_sequence(output):
-                return list(map(str, output))
-            else:
-                return str(output)
-        else:
-            return output
-    except:
-        return pos
-
-
 def distance_to_station(pos1, pos2):
     """
     http://www.johndcook.com/blog/python_longitude_latitude/
@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 5
+
+
+def get_cache_path(file_path):
+    file_path = Path(file_path)
+    return Path(file_path.parent, f'.{file_path.name}.cache')
+
+
+def get_source_key(file_path):
+    """Returns the key identifying the current content of the station source file."""
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    with open(file_path, 'rb') as fid:
+        content_hash = hashlib.sha1(fid.read()).hexdigest()
+    return dict(version=CACHE_VERSION,
+                path=str(file_path.resolve()),
+                size=stat.st_size,
+                mtime=stat.st_mtime_ns,
+                sha1=content_hash)
+
+
+def load(file_path, key):
+    """
+    Returns the compiled station data saved for file_path.
+    Returns None if there is no snapshot or if it is stale (not matching key) or corrupt.
+    """
+    cache_path = get_cache_path(file_path)
+    if not cache_path.exists():
+        return None
+    try:
+        with open(cache_path, 'rb') as fid:
+            snapshot = pickle.load(fid)
+        if snapshot.get('key') != key:
+            logger.info(f'Station cache is stale: {cache_path}')
+            return None
+        return snapshot['data']
+    except Exception as e:
+        logger.warning(f'Could not read station cache {cache_path}: {e}')
+        return None
+
+
+def save(file_path, key, data):
+    """
+    Saves the compiled station data for file_path. The snapshot is replaced atomically.
+    key should be taken with get_source_key before the source file was parsed.
+    """
+    cache_path = get_cache_path(file_path)
+    try:
+        snapshot = dict(key=key, data=data)
+        fd, temp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=cache_path.name)
+        try:
+            with os.fdopen(fd, 'wb') as fid:
+                pickle.dump(snapshot, fid, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    except OSError as e:
+        logger.warning(f'Could not save station cache {cache_path}: {e}')
+        return False
+    logger.debug(f'Station cache saved: {cache_path}')
+    return True
@@ -0,0 +1,193 @@
+import math
+
+import numpy as np
+
+from pre_system_svea.coordinates import decmin_to_decdeg
+
+EARTH_RADIUS = 6363 * 1000  # Same radius (m) as in station.distance_to_station
+
+
+def _unit_vectors(lat_dd, lon_dd):
+    return _unit_vectors_from_radians(np.radians(lat_dd), np.radians(lon_dd))
+
+
+def _unit_vectors_from_radians(lat_rad, lon_rad):
+    cos_lat = np.cos(lat_rad)
+    return cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)
+
+
+class StationIndex:
+    """
+    Spatial index over station positions. Positions are stored as 3D unit vectors on the sphere so that
+    the angle to every station is given by a dot product against the cached vectors. Distances are returned
+    in meters and rounded in the same way as station.distance_to_station.
+
+    The station positions in decimal degrees (lat_dd, lon_dd) and radians (lat_rad, lon_rad) are kept as well.
+    Queries for k nearest, all within a radius and all stations whose own radius covers a position return row
+    positions ordered by distance. Equal distances are ordered as in the file. These only measure the stations
+    in the latitude band that can be within reach (found by bisection in the stations sorted by z = sin(lat)).
+    """
+    chunk_size = 256
+    # First search radius (m) for nearest_k. Grown until the band holds the k closest stations.
+    nearest_k_radius = 20000.
+
+    def __init__(self, lat, lon, radius=None):
+        """
+        :param lat: sequence of latitudes in degrees and decimal minutes (LAT_DM)
+        :param lon: sequence of longitudes in degrees and decimal minutes (LONG_DM)
+        :param radius: optional sequence with the radius in meters of each station (OUT_OF_BOUNDS_RADIUS).
+                       Needed for covering.
+        """
+        self.radius = None if radius is None else np.asarray(radius, dtype=float)
+        self.lat_dd = decmin_to_decdeg(lat)
+        self.lon_dd = decmin_to_decdeg(lon)
+        self.lat_rad = np.radians(self.lat_dd)
+        self.lon_rad = np.radians(self.lon_dd)
+        self._x, self._y, self._z = _unit_vectors_from_radians(self.lat_rad, self.lon_rad)
+        self._vectors = np.vstack([self._x, self._y, self._z])
+        self._z_order = np.argsort(self._z, kind='stable')
+        self._z_sorted = self._z[self._z_order]
+
+    def __len__(self):
+        return len(self._x)
+
+    @staticmethod
+    def _query_vectors(lat, lon):
+        return _unit_vectors(np.array([decmin_to_decdeg(lat)]), np.array([decmin_to_decdeg(lon)]))
+
+    def _exact_cos(self, indices, qx, qy, qz):
+        # Written out component wise so that a station/position pair always gives the same distance,
+        # no matter if it was computed in a scalar or in a (chunked) batch query.
+        cos = self._x[indices] * qx + self._y[indices] * qy + self._z[indices] * qz
+        return np.clip(cos, -1., 1., out=cos)
+
+    def _nearest(self, qx, qy, qz):
+        # Candidates are found with a fast matrix product. Only stations that can round to the same distance
+        # as the closest one are then measured exactly. Ties are resolved to the first station in file order,
+        # as in the old full scan.
+        cos = np.column_stack([qx, qy, qz]) @ self._vectors
+        best = np.arccos(np.clip(cos.max(axis=1), -1., 1.))
+        limit = np.cos(best + 1. / EARTH_RADIUS) - 1e-9
+        rows, cols = np.nonzero(cos >= limit[:, None])
+        dist = np.rint(np.arccos(self._exact_cos(cols, qx[rows], qy[rows], qz[rows])) * EARTH_RADIUS)
+        order = np.lexsort((cols, dist, rows))
+        rows, cols, dist = rows[order], cols[order], dist[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        # Rows without any candidate (NaN position) keep index -1 and distance NaN
+        indices = np.full(len(qx), -1, dtype=int)
+        distances = np.full(len(qx), np.nan)
+        indices[rows[first]] = cols[first]
+        distances[rows[first]] = dist[first]
+        return indices, distances
+
+    def distance(self, index, lat, lon):
+        """Returns the rounded distance in meters from the given position (LAT_DM, LONG_DM) to station at index."""
+        qx, qy, qz = self._query_vectors(lat, lon)
+        return int(np.rint(np.arccos(self._exact_cos(index, qx, qy, qz)[0]) * EARTH_RADIUS))
+
+    def distances_to(self, indices, lat, lon):
+        """Returns the rounded distances in meters from the given position (LAT_DM, LONG_DM) to stations at indices."""
+        qx, qy, qz = self._query_vectors(lat, lon)
+        return np.rint(np.arccos(self._exact_cos(np.asarray(indices, dtype=int), qx, qy, qz)) * EARTH_RADIUS)
+
+    def distances(self, lat, lon):
+        """Returns the rounded distance in meters from the given position (LAT_DM, LONG_DM) to all stations."""
+        qx, qy, qz = self._query_vectors(lat, lon)
+        return np.rint(np.arccos(self._exact_cos(slice(None), qx, qy, qz)) * EARTH_RADIUS)
+
+    def nearest(self, lat, lon):
+        """
+        Returns the row position of the closest station and the distance to it in meters.
+        Ties are resolved to the first station in file order. Raises ValueError if the position is not valid.
+        """
+        qx, qy, qz = self._query_vectors(lat, lon)
+        if np.isnan(qx[0]) or np.isnan(qy[0]) or np.isnan(qz[0]):
+            raise ValueError(f'Not a valid position: {lat}, {lon}')
+        indices, distances = self._nearest(qx, qy, qz)
+        return int(indices[0]), int(distances[0])
+
+    @staticmethod
+    def _sorted(indices, dist):
+        # indices in file order so that equal distances keep the file order
+        order = np.argsort(dist, kind='stable')
+        return indices[order], dist[order]
+
+    def _candidates(self, query, radius):
+        """
+        Returns the row positions (in file order) of and rounded distances to the stations in the latitude band
+        holding every station within radius meters. All stations if the position is not valid.
+        :param query: unit vector (qx, qy, qz) of the position
+        """
+        qx, qy, qz = query
+        lat_rad = math.asin(max(-1., min(1., qz[0]))) if not np.isnan(qz[0]) else math.nan
+        # One meter extra for the rounding of the distances
+        angle = (radius + 1.) / EARTH_RADIUS
+        if math.isnan(lat_rad) or math.isnan(angle):
+            indices = np.arange(len(self))
+        else:
+            low = math.sin(max(lat_rad - angle, -math.pi / 2)) - 1e-12
+            high = math.sin(min(lat_rad + angle, math.pi / 2)) + 1e-12
+            start, stop = np.searchsorted(self._z_sorted, [low, high])
+            indices = np.sort(self._z_order[start:stop])
+        return indices, np.rint(np.arccos(self._exact_cos(indices, qx, qy, qz)) * EARTH_RADIUS)
+
+    def nearest_k(self, lat, lon, k):
+        """Returns the row positions of and distances to the k closest stations."""
+        k = max(0, min(int(k), len(self)))
+        if k == 0:
+            return np.array([], dtype=int), np.array([])
+        query = self._query_vectors(lat, lon)
+        radius = self.nearest_k_radius
+        while True:
+            indices, dist = self._candidates(query, radius)
+            if len(indices) >= k:
+                kth_distance = np.partition(dist, k - 1)[k - 1]
+                # Stations outside the band are more than radius meters away
+                if kth_distance <= radius or len(indices) == len(self):
+                    break
+            radius *= 4
+        keep = dist <= kth_distance
+        indices, distances = self._sorted(indices[keep], dist[keep])
+        return indices[:k], distances[:k]
+
+    def within(self, lat, lon, radius):
+        """Returns the row positions of and distances to all stations within radius meters."""
+        indices, dist = self._candidates(self._query_vectors(lat, lon), radius)
+        keep = dist <= radius
+        return self._sorted(indices[keep], dist[keep])
+
+    def covering(self, lat, lon):
+        """Returns the row positions of and distances to all stations whose own radius covers the position."""
+        if self.radius is None:
+            raise ValueError('No station radius given to StationIndex')
+        max_radius = np.nanmax(self.radius) if len(self.radius) else 0.
+        indices, dist = self._candidates(self._query_vectors(lat, lon), max_radius)
+        keep = dist <= self.radius[indices]
+        return self._sorted(indices[keep], dist[keep])
+
+    def nearest_many(self, lat, lon, decimal_degrees=False):
+        """
+        Vectorized version of nearest.
+        :param lat: array of latitudes, LAT_DM format unless decimal_degrees is True
+        :param lon: array of longitudes, LONG_DM format unless decimal_degrees is True
+        :param decimal_degrees: True if lat and lon are given in decimal degrees
+        :return: tuple (indices, distances). Positions that are NaN gets index -1 and distance NaN.
+        """
+        lat = np.asarray(lat, dtype=float).ravel()
+        lon = np.asarray(lon, dtype=float).ravel()
+        if lat.shape != lon.shape:
+            raise ValueError('lat and lon must have the same length')
+        if not decimal_degrees:
+            lat = decmin_to_decdeg(lat, errors='coerce')
+            lon = decmin_to_decdeg(lon, errors='coerce')
+        qx, qy, qz = _unit_vectors(lat, lon)
+        valid = ~(np.isnan(qx) | np.isnan(qy) | np.isnan(qz))
+
+        indices = np.full(len(lat), -1, dtype=int)
+        distances = np.full(len(lat), np.nan)
+        valid_rows = np.flatnonzero(valid)
+        for start in range(0, len(valid_rows), self.chunk_size):
+            rows = valid_rows[start:start + self.chunk_size]
+            indices[rows], distances[rows] = self._nearest(qx[rows], qy[rows], qz[rows])
+        return indices, distances
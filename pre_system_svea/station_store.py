@@ -0,0 +1,131 @@
+from collections.abc import Mapping
+
+
+class StationStore:
+    """
+    Column store of a station list: one numpy array per column. Rows are read through StationRecord views
+    so that a lookup does not copy the row.
+
+    Besides the columns of the station file a record has the keys lat, lon, depth and station (the same as
+    added to station_info before), and any extra values given when the record is created (e.g. distance).
+    """
+
+    def __init__(self, df, station_col='STATION_NAME', lat_col='LAT_DM', lon_col='LONG_DM', depth_col='WADEP'):
+        self.columns = {col: df[col].to_numpy() for col in df.columns}
+        self.column_names = tuple(df.columns)
+        self.aliases = dict(lat=lat_col, lon=lon_col, station=station_col)
+        self.depth_col = depth_col
+        self.keys = self.column_names + ('lat', 'lon', 'depth', 'station')
+        self._key_set = frozenset(self.keys)
+
+    def __len__(self):
+        return len(self.columns[self.column_names[0]]) if self.column_names else 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_key_set']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._key_set = frozenset(self.keys)
+
+    def column(self, key):
+        """Returns the numpy array for a column (or alias). Not to be modified."""
+        return self.columns[self.aliases.get(key, key)]
+
+    def value(self, key, row):
+        """Returns the value of key in row as a Python object. Raises KeyError for unknown keys."""
+        column = self.columns.get(key)
+        if column is not None:
+            return column.item(row)
+        if key == 'depth':
+            return str(self.columns[self.depth_col].item(row))
+        col = self.aliases.get(key)
+        if col is None:
+            raise KeyError(key)
+        return self.columns[col].item(row)
+
+    def has_key(self, key):
+        return key in self._key_set
+
+    def record(self, row, **extra):
+        return _new_record(self, row, extra or None)
+
+    def row_dict(self, row):
+        return {key: self.value(key, row) for key in self.keys}
+
+
+class StationRecord(Mapping):
+    """
+    Immutable read only view of one row in a StationStore. Behaves as the station_info dict it replaces
+    (station_info['STATION_NAME'], station_info.get('lat'), dict(station_info) etc.). Use to_dict for a copy
+    that can be modified.
+    """
+    __slots__ = ('_store', '_row', '_extra')
+
+    def __init__(self, store, row, extra=None):
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_row', row)
+        object.__setattr__(self, '_extra', extra)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('StationRecord is read only')
+
+    def __delattr__(self, key):
+        raise AttributeError('StationRecord is read only')
+
+    def __reduce__(self):
+        # A pickled (or deep copied) record becomes a plain dict instead of dragging the whole store along
+        return dict, (self.to_dict(),)
+
+    @property
+    def row(self):
+        """Row position in the station list"""
+        return self._row
+
+    def __getitem__(self, key):
+        extra = self._extra
+        if extra and key in extra:
+            return extra[key]
+        return self._store.value(key, self._row)
+
+    def __contains__(self, key):
+        return self._store.has_key(key) or bool(self._extra and key in self._extra)
+
+    def __iter__(self):
+        yield from self._store.keys
+        if self._extra:
+            for key in self._extra:
+                if not self._store.has_key(key):
+                    yield key
+
+    def __len__(self):
+        if not self._extra:
+            return len(self._store.keys)
+        return len(self._store.keys) + sum(1 for key in self._extra if not self._store.has_key(key))
+
+    def to_dict(self):
+        """Returns the record as a new dict."""
+        data = self._store.row_dict(self._row)
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def __repr__(self):
+        return f'StationRecord({self.to_dict()})'
+
+
+# Records are created on every lookup. Setting the slots directly is about twice as fast as going through
+# __init__ and object.__setattr__.
+_set_store = StationRecord._store.__set__
+_set_row = StationRecord._row.__set__
+_set_extra = StationRecord._extra.__set__
+
+
+def _new_record(store, row, extra):
+    record = object.__new__(StationRecord)
+    _set_store(record, store)
+    _set_row(record, row)
+    _set_extra(record, extra)
+    return record
@@ -0,0 +1,213 @@
+"""
+Background polling of the current station info in SVEPA.
+
+SvepaInfoService asks SVEPA (svepa.get_current_station_info) at a fixed interval in its own thread and keeps the
+latest answer in memory. Callers get that snapshot without touching the database. If SVEPA can not be reached
+the last good snapshot is kept (and grows stale) while the poller retries with exponential backoff.
+
+Only connection errors (see is_connection_error) are handled as SVEPA being unreachable. Any other error (a bug,
+missing credentials, svepa not installed) is raised to the caller of get_info.
+"""
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, socket.gaierror, socket.herror)
+# Database driver errors (pyodbc, psycopg2, SQLAlchemy) raised when the database can not be reached
+CONNECTION_ERROR_NAMES = {'OperationalError', 'InterfaceError'}
+
+
+def is_connection_error(error):
+    """True if error means that SVEPA could not be reached (as opposed to SVEPA or the call being wrong)."""
+    if isinstance(error, CONNECTION_ERRORS):
+        return True
+    return any(cls.__name__ in CONNECTION_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class SvepaSnapshot:
+    """
+    Latest known SVEPA info.
+    info: dict from svepa.get_current_station_info, None if SVEPA has never answered
+    fetched_time: time.time() when info was fetched
+    error: exception from the last attempt, None if it succeeded
+    attempt_time: time.time() of the last attempt
+    """
+
+    def __init__(self, info=None, fetched_time=None, error=None, attempt_time=None, max_age=None):
+        self.info = info
+        self.fetched_time = fetched_time
+        self.error = error
+        self.attempt_time = attempt_time
+        self.max_age = max_age
+
+    def __repr__(self):
+        return f'SvepaSnapshot(age={self.age}, stale={self.stale}, error={self.error!r})'
+
+    @property
+    def age(self):
+        """Seconds since info was fetched. None if never fetched."""
+        if self.fetched_time is None:
+            return None
+        return time.time() - self.fetched_time
+
+    @property
+    def stale(self):
+        """True if info is missing, older than max_age or the last attempt to renew it failed."""
+        if self.fetched_time is None or self.error is not None:
+            return True
+        return self.max_age is not None and self.age > self.max_age
+
+
+class SvepaInfoService:
+    """
+    Polls SVEPA for the current station info in a daemon thread.
+
+    get_snapshot never blocks. get_info returns the info in memory if it is current. Otherwise it asks the poller
+    to try again and waits for that attempt (at most wait seconds) before it raises. updated is set and callbacks
+    are called with the new info when the info has changed.
+    """
+
+    def __init__(self, credentials_path, interval=10., max_age=None, max_backoff=300., svepa_module=None):
+        """
+        :param credentials_path: path to the SVEPA credentials file
+        :param interval: seconds between polls
+        :param max_age: age in seconds after which a snapshot is considered stale. Defaults to 3 * interval
+        :param max_backoff: max seconds between attempts when SVEPA can not be reached
+        :param svepa_module: object with get_current_station_info(path_to_svepa_credentials=...). Defaults to the
+                             svepa package. Give a fake here to run without the database.
+        """
+        self.credentials_path = credentials_path
+        self.interval = interval
+        self.max_age = 3 * interval if max_age is None else max_age
+        self.max_backoff = max_backoff
+        self.updated = threading.Event()
+        self.failures = 0
+        self._svepa = svepa_module
+        self._snapshot = SvepaSnapshot(max_age=self.max_age)
+        self._attempts = 0
+        self._attempt_done = threading.Condition()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._callbacks = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """callback(info) is called from the poller thread when the info has changed."""
+        self._callbacks.append(callback)
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='svepa_info')
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def refresh(self):
+        """Makes the poller ask SVEPA now instead of at the next interval (also during backoff)."""
+        self._wake.set()
+
+    def get_snapshot(self):
+        return self._snapshot
+
+    def get_info(self, wait=None, allow_stale=False):
+        """
+        Returns the latest info.
+
+        If the snapshot is stale and the poller has not tried within the last interval, a new attempt is made now
+        and waited for (at most wait seconds). While SVEPA is failing the poller keeps its backoff and the answer
+        is given from the snapshot without waiting. Errors that are not connection errors are raised as they are. If
+        the info is still stale ConnectionError (SVEPA unreachable, with the error as cause) or TimeoutError (no
+        answer within wait) is raised, unless allow_stale is True and there is info to return.
+        :param wait: max seconds to wait for a new attempt
+        :param allow_stale: return old info instead of raising if SVEPA can not be reached
+        """
+        if not self.running:
+            self.start()
+        snapshot = self._snapshot
+        # A snapshot with an error comes from a failed attempt: the poller is backing off and is not woken
+        if snapshot.stale and wait and snapshot.error is None and not self._attempted_recently(snapshot):
+            self._wait_for_attempt(snapshot, wait)
+            snapshot = self._snapshot
+        error = snapshot.error
+        if error is not None and not is_connection_error(error):
+            raise error
+        if not snapshot.stale or (allow_stale and snapshot.info is not None):
+            return snapshot.info
+        last_info = 'none' if snapshot.age is None else f'{snapshot.age:.0f} s old'
+        if error is not None:
+            raise ConnectionError(f'Could not get info from SVEPA (last info: {last_info})') from error
+        raise TimeoutError(f'No new info from SVEPA (last info: {last_info})')
+
+    def _attempted_recently(self, snapshot):
+        return snapshot.attempt_time is not None and time.time() - snapshot.attempt_time < self._next_delay()
+
+    def _wait_for_attempt(self, snapshot, timeout):
+        with self._attempt_done:
+            if self._snapshot is not snapshot:
+                # An attempt has finished since snapshot was taken
+                return
+            attempts = self._attempts
+            if attempts:
+                self.refresh()
+            self._attempt_done.wait_for(lambda: self._attempts > attempts, timeout)
+
+    def _get_svepa(self):
+        if self._svepa is None:
+            import svepa
+            self._svepa = svepa
+        return self._svepa
+
+    def _poll(self):
+        attempt_time = time.time()
+        previous = self._snapshot
+        try:
+            info = self._get_svepa().get_current_station_info(path_to_svepa_credentials=self.credentials_path)
+        except Exception as e:
+            self.failures += 1
+            if not is_connection_error(e):
+                logger.exception('Error getting info from SVEPA')
+            elif self.failures == 1:
+                logger.warning(f'Could not get info from SVEPA: {e}')
+            self._snapshot = SvepaSnapshot(previous.info, previous.fetched_time, error=e, attempt_time=attempt_time,
+                                           max_age=self.max_age)
+            return
+        if self.failures:
+            logger.info(f'SVEPA answered again after {self.failures} failed attempts')
+        self.failures = 0
+        self._snapshot = SvepaSnapshot(info, time.time(), attempt_time=attempt_time, max_age=self.max_age)
+        if info != previous.info:
+            self.updated.set()
+            for callback in self._callbacks:
+                try:
+                    callback(info)
+                except Exception:
+                    logger.exception('Error in SVEPA info callback')
+
+    def _next_delay(self):
+        if not self.failures:
+            return self.interval
+        return min(self.interval * 2 ** self.failures, self.max_backoff)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self._poll()
+            with self._attempt_done:
+                self._attempts += 1
+                self._attempt_done.notify_all()
+            self._wake.wait(self._next_delay())
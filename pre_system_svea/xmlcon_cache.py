@@ -0,0 +1,38 @@
+import threading
+from pathlib import Path
+
+from pre_system_svea import instrumentation
+
+
+class XmlconCache:
+    """
+    Parsed XMLCON files (file_explorer.seabird.XmlconFile) keyed by file path.
+    A file is parsed again only if its mtime or size has changed.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_path):
+        from file_explorer import seabird
+        file_path = str(file_path)
+        stat = Path(file_path).stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._cache.get(file_path)
+        if cached and cached[0] == key:
+            return cached[1]
+        with instrumentation.measure('xmlcon.parse', nbytes=stat.st_size):
+            obj = seabird.XmlconFile(file_path, ignore_pattern=True)
+        with self._lock:
+            self._cache[file_path] = (key, obj)
+        return obj
+
+    def preload(self, file_paths):
+        for file_path in file_paths:
+            self.get(file_path)
+
+    def clear(self):
+        with self._lock:
+            self._cache = {}
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from pre_system_svea.async_controller import AsyncController
+
+
+class SlowBackend:
+    """Stand in for Controller: every call blocks until release is set."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def _slow(self, name, result):
+        with self._lock:
+            self.calls.append(name)
+        self.release.wait(5)
+        return result
+
+    def get_next_serno(self, **kwargs):
+        return self._slow('get_next_serno', '0042')
+
+    def series_exists(self, **kwargs):
+        return self._slow('series_exists', False)
+
+    def get_svepa_info(self, credentials_path):
+        return self._slow('get_svepa_info', dict(station='BY5 BORNHOLMSDJ'))
+
+
+@pytest.fixture
+def backend():
+    backend = SlowBackend()
+    yield backend
+    backend.release.set()
+
+
+@pytest.fixture
+def async_controller(backend):
+    async_controller = AsyncController(backend, max_workers=2)
+    yield async_controller
+    async_controller.shutdown()
+
+
+def test_identical_calls_are_coalesced(async_controller, backend):
+    futures = [async_controller.get_next_serno(year=2024, ship='77SE', cruise='01') for _ in range(20)]
+    assert async_controller.in_flight == 1
+    backend.release.set()
+    assert {future.result(timeout=5) for future in futures} == {'0042'}
+    assert backend.calls == ['get_next_serno']
+    assert async_controller.in_flight == 0
+
+
+def test_different_calls_are_not_coalesced(async_controller, backend):
+    backend.release.set()
+    futures = [async_controller.series_exists(serno=str(i).zfill(4)) for i in range(4)]
+    assert [future.result(timeout=5) for future in futures] == [False] * 4
+    assert backend.calls == ['series_exists'] * 4
+
+
+def test_call_cancelled_while_queued_never_runs(async_controller, backend):
+    blocking = [async_controller.series_exists(serno=f'b{i}') for i in range(2)]
+    queued = async_controller.get_svepa_info('credentials.yaml')
+    assert queued.cancel()
+    backend.release.set()
+    for future in blocking:
+        future.result(timeout=5)
+    time.sleep(0.1)
+    assert queued.cancelled()
+    assert backend.calls == ['series_exists'] * 2
+
+
+def test_cancelled_caller_does_not_cancel_coalesced_call(async_controller, backend):
+    blocking = [async_controller.series_exists(serno=f'b{i}') for i in range(2)]
+    first = async_controller.get_svepa_info('credentials.yaml')
+    second = async_controller.get_svepa_info('credentials.yaml')
+    assert first.cancel()
+    backend.release.set()
+    assert second.result(timeout=5) == dict(station='BY5 BORNHOLMSDJ')
+    for future in blocking:
+        future.result(timeout=5)
+    assert backend.calls.count('get_svepa_info') == 1
+
+
+def test_timeout_raises_timeout_error(async_controller, backend):
+    blocking = [async_controller.series_exists(serno=f'b{i}') for i in range(2)]
+    timed_out = async_controller.get_svepa_info('other.yaml', timeout=0.1)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        timed_out.result(timeout=5)
+    assert time.monotonic() - start < 1
+    backend.release.set()
+    for future in blocking:
+        future.result(timeout=5)
+    time.sleep(0.1)
+    # Nobody waits for the timed out call any more, so it is dropped from the queue
+    assert backend.calls == ['series_exists'] * 2
+
+
+def test_default_timeout(backend):
+    async_controller = AsyncController(backend, max_workers=1, default_timeout=0.1)
+    try:
+        with pytest.raises(TimeoutError):
+            async_controller.get_next_serno(year=2024).result(timeout=5)
+    finally:
+        backend.release.set()
+        async_controller.shutdown()
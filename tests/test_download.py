@@ -0,0 +1,148 @@
+import http.server
+import socket
+import threading
+import types
+from pathlib import Path
+
+import pytest
+import requests
+
+from pre_system_svea import download
+
+STATION_LIST = b'STATION_NAME\tLAT_DM\tLONG_DM\nBY5 BORNHOLMSDJ\t5515.00\t1559.00\n'
+ETAG = '"station-list-1"'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    /station_list.txt: served with an ETag, 304 if If-None-Match matches
+    /broken.txt: a file without the station list header
+    /flaky.txt: 503 for the first server.failures requests, then the station list
+    /truncated.txt: the connection is closed before the whole body is sent
+    /missing.txt: 404
+    """
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == '/station_list.txt':
+            if self.headers.get('If-None-Match') == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self._send(STATION_LIST, etag=ETAG)
+        elif self.path == '/broken.txt':
+            self._send(b'<html>Sign in</html>\n')
+        elif self.path == '/flaky.txt':
+            if self.server.failures:
+                self.server.failures -= 1
+                self.send_error(503)
+                return
+            self._send(STATION_LIST)
+        elif self.path == '/truncated.txt':
+            self.send_response(200)
+            self.send_header('Content-Length', str(10 * len(STATION_LIST)))
+            self.end_headers()
+            self.wfile.write(STATION_LIST)
+            self.close_connection = True
+        else:
+            self.send_error(404)
+
+    def _send(self, body, etag=None):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    server.failures = 0
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def waits(monkeypatch):
+    waits = []
+    monkeypatch.setattr(download, 'time', types.SimpleNamespace(sleep=waits.append))
+    return waits
+
+
+def validate_header(file_path):
+    with open(file_path, encoding='utf8') as fid:
+        header = fid.readline().rstrip('\r\n').split('\t')
+    missing = [col for col in ['STATION_NAME', 'LAT_DM', 'LONG_DM'] if col not in header]
+    if missing:
+        raise ValueError(f'Missing columns in downloaded station file: {missing}')
+
+
+def files_in(directory):
+    return sorted(path.name for path in Path(directory).iterdir())
+
+
+def test_download_and_skip_unchanged(server, tmp_path):
+    file_path = Path(tmp_path, 'station_list.txt')
+    url = f'{server.url}/station_list.txt'
+    assert download.download_file(url, file_path, validate=validate_header)
+    assert file_path.read_bytes() == STATION_LIST
+
+    assert not download.download_file(url, file_path, validate=validate_header)
+    assert server.requests[-1][1]['If-None-Match'] == ETAG
+    assert files_in(tmp_path) == ['.station_list.txt.download.json', 'station_list.txt']
+
+
+def test_invalid_file_is_not_swapped_in(server, tmp_path):
+    file_path = Path(tmp_path, 'station_list.txt')
+    file_path.write_bytes(STATION_LIST)
+    with pytest.raises(ValueError):
+        download.download_file(f'{server.url}/broken.txt', file_path, validate=validate_header)
+    assert file_path.read_bytes() == STATION_LIST
+    assert files_in(tmp_path) == ['station_list.txt']
+
+
+def test_client_error_is_not_retried(server, tmp_path, waits):
+    with pytest.raises(requests.HTTPError):
+        download.download_file(f'{server.url}/missing.txt', Path(tmp_path, 'station_list.txt'))
+    assert len(server.requests) == 1
+    assert waits == []
+    assert files_in(tmp_path) == []
+
+
+def test_server_error_is_retried_with_backoff(server, tmp_path, waits):
+    server.failures = 2
+    file_path = Path(tmp_path, 'station_list.txt')
+    assert download.download_file(f'{server.url}/flaky.txt', file_path, retries=3, backoff=1.)
+    assert waits == [1., 2.]
+    assert file_path.read_bytes() == STATION_LIST
+
+
+def test_connection_error_is_retried_then_raised(tmp_path, waits):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    with pytest.raises(requests.ConnectionError):
+        download.download_file(f'http://127.0.0.1:{port}/station_list.txt', Path(tmp_path, 'station_list.txt'),
+                               retries=2, backoff=0.5, timeout=2)
+    assert waits == [0.5, 1.]
+    assert files_in(tmp_path) == []
+
+
+def test_interrupted_download_leaves_no_temp_file(server, tmp_path, waits):
+    file_path = Path(tmp_path, 'station_list.txt')
+    file_path.write_bytes(STATION_LIST)
+    with pytest.raises(requests.RequestException):
+        download.download_file(f'{server.url}/truncated.txt', file_path, retries=1, backoff=0.5)
+    assert waits == [0.5]
+    assert file_path.read_bytes() == STATION_LIST
+    assert files_in(tmp_path) == ['station_list.txt']
@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from import_time import HEAVY_MODULES, get_import_times
+
+
+def test_controller_does_not_import_heavy_modules():
+    times = get_import_times('pre_system_svea.controller')
+    loaded = {name.split('.')[0] for _, _, name in times}
+    assert 'pre_system_svea' in loaded
+    assert [name for name in HEAVY_MODULES if name in loaded] == []
@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import pytest
+
+from pre_system_svea.position_monitor import PositionMonitor, iter_fixes, parse_nmea
+from pre_system_svea.resource import get_resources
+from pre_system_svea.station import StationFile
+
+# Recorded track from BY5 BORNHOLMSDJ to BY4 CHRISTIANSÖ, one fix per minute (GGA and RMC). Contains one
+# sentence of each kind that should be skipped: GSV, minutes >= 60, bad checksum, no checksum and no fix.
+REPLAY_PATH = Path(Path(__file__).parent, 'data', 'bornholm_by5_to_by4.nmea')
+NR_VALID_FIXES = 61
+
+
+@pytest.fixture(scope='module')
+def station_file():
+    resources = get_resources()
+    return StationFile(backup_file_path=resources.backup_station_file,
+                       primary_url=resources.primary_station_file_url)
+
+
+def with_checksum(body):
+    value = 0
+    for char in body:
+        value ^= ord(char)
+    return f'${body}*{value:02X}'
+
+
+def test_parse_nmea_gga():
+    fix = parse_nmea(with_checksum('GPGGA,080000.00,5515.0000,N,01559.0000,E,1,09,0.9,4.2,M,33.1,M,,'))
+    assert (fix.lat, fix.lon) == (5515.0, 1559.0)
+    assert fix.time.hour == 8
+
+
+def test_parse_nmea_rejects_invalid_sentences():
+    assert parse_nmea('$GPGGA,082000.00,5517.6667,N,01169.20,E,1,09,0.9,4.2,M,33.1,M,,*6B') is None
+    assert parse_nmea('$GPGGA,080000.00,5515.0000,N,01559.0000,E,1,09,0.9,4.2,M,33.1,M,,*00') is None
+    assert parse_nmea(with_checksum('GPGGA,080000.00,9115.0000,N,01559.0000,E,1,09,0.9,4.2,M,33.1,M,,')) is None
+    assert parse_nmea(with_checksum('GPGGA,080000.00,5515.0000,N,18059.0000,E,1,09,0.9,4.2,M,33.1,M,,')) is None
+
+
+def test_parse_nmea_checksum_can_be_optional():
+    sentence = '$GPGGA,080000.00,5515.0000,N,01559.0000,E,1,09,0.9,4.2,M,33.1,M,,'
+    assert parse_nmea(sentence) is None
+    assert parse_nmea(sentence, require_checksum=False).lat == 5515.0
+
+
+def test_replay_skips_invalid_sentences():
+    fixes = list(iter_fixes(REPLAY_PATH))
+    assert len(fixes) == NR_VALID_FIXES
+
+
+def test_replay_is_paced_with_speed():
+    waits = []
+    list(iter_fixes(REPLAY_PATH, speed=60, sleep=waits.append))
+    assert waits == [1.] * (NR_VALID_FIXES - 1)
+
+
+def test_monitor_follows_replay(station_file):
+    monitor = PositionMonitor(station_file)
+    changes = []
+    monitor.add_callback(lambda info: changes.append((info['station'], info['acceptable'])))
+    monitor.run(REPLAY_PATH)
+
+    assert monitor.updates == NR_VALID_FIXES
+    assert monitor.searches < NR_VALID_FIXES
+    assert changes[0] == ('BY5 BORNHOLMSDJ', True)
+    assert changes[-1] == ('BY4 CHRISTIANSÖ', True)
+    last_fix = list(iter_fixes(REPLAY_PATH))[-1]
+    assert station_file.get_closest_station(last_fix.lat, last_fix.lon)['station'] == monitor.current['station']
+
+
+def test_monitor_keeps_running_after_bad_fix(station_file):
+    monitor = PositionMonitor(station_file)
+    update = monitor.update
+    calls = []
+
+    def failing_update(lat, lon, **kwargs):
+        calls.append(lat)
+        if len(calls) == 2:
+            raise ValueError('garbled fix')
+        return update(lat, lon, **kwargs)
+
+    monitor.update = failing_update
+    monitor.run(REPLAY_PATH)
+    assert len(calls) == NR_VALID_FIXES
+    assert monitor.current['station'] == 'BY4 CHRISTIANSÖ'
@@ -0,0 +1,68 @@
+import types
+
+import psutil
+import pytest
+
+from pre_system_svea import seasave
+from pre_system_svea.seasave import SeasaveSupervisor
+
+
+class FakeProcess:
+    pid = 1234
+
+    def __init__(self, *args, **kwargs):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return 0
+
+
+@pytest.fixture
+def processes(monkeypatch):
+    """Names of the running processes seen by the process scan"""
+    names = []
+    monkeypatch.setattr(psutil, 'process_iter',
+                        lambda attrs=None: [types.SimpleNamespace(info=dict(name=name)) for name in names])
+    return names
+
+
+@pytest.fixture
+def started(monkeypatch):
+    calls = []
+
+    def popen(*args, **kwargs):
+        calls.append(args)
+        return FakeProcess()
+
+    monkeypatch.setattr(seasave, 'subprocess', types.SimpleNamespace(Popen=popen))
+    return calls
+
+
+def test_is_running_uses_cached_scan(processes):
+    supervisor = SeasaveSupervisor(scan_ttl=60.)
+    assert not supervisor.is_running()
+    processes.append('Seasave.exe')
+    assert not supervisor.is_running()
+    assert supervisor.is_running(max_age=0)
+
+
+def test_start_scans_again(processes, started):
+    supervisor = SeasaveSupervisor(scan_ttl=60.)
+    assert not supervisor.is_running()
+    # Started outside the pre-system after the last (cached) scan
+    processes.append('Seasave.exe')
+    with pytest.raises(ChildProcessError):
+        supervisor.start('Seasave.exe', 'Seasave.psa')
+    assert started == []
+
+
+def test_start(processes, started):
+    supervisor = SeasaveSupervisor()
+    assert supervisor.start('Seasave.exe', 'Seasave.psa') == 1234
+    assert started == [(['Seasave.exe', '-p=Seasave.psa'],)]
+    assert supervisor.is_running()
+    with pytest.raises(ChildProcessError):
+        supervisor.start('Seasave.exe', 'Seasave.psa')
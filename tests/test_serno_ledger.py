@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from pre_system_svea.controller import Controller
+from pre_system_svea.serno_ledger import FileLock, SernoLedger
+
+YEAR = '2020'
+SHIP = '77SE'
+CRUISE = '01'
+
+
+def touch_package(directory, serno, cruise=CRUISE):
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    Path(directory, f'sbe09_1387_{YEAR}0207_0801_{SHIP}_{cruise}_{serno}.hex').touch()
+
+
+@pytest.fixture
+def raw_directory(tmp_path):
+    directory = Path(tmp_path, 'raw', YEAR)
+    directory.mkdir(parents=True)
+    return directory
+
+
+def create_ledger(tmp_path, raw_directory, owner, **kwargs):
+    return SernoLedger(Path(tmp_path, 'serno_ledger.json'), directories=[raw_directory], owner=owner, **kwargs)
+
+
+def reserve_in_process(tmp_path, raw_directory, owner, queue):
+    ledger = create_ledger(tmp_path, raw_directory, owner)
+    queue.put(ledger.reserve(YEAR, SHIP, CRUISE))
+
+
+def test_owners_get_different_sernos(tmp_path, raw_directory):
+    touch_package(raw_directory, '0003')
+    first = create_ledger(tmp_path, raw_directory, 'first')
+    second = create_ledger(tmp_path, raw_directory, 'second')
+
+    assert first.next_serno(YEAR, SHIP, CRUISE) == '0004'
+    assert first.reserve(YEAR, SHIP, CRUISE) == '0004'
+    assert first.reserve(YEAR, SHIP, CRUISE) == '0004'
+    assert second.next_serno(YEAR, SHIP, CRUISE) == '0005'
+    assert second.reserve(YEAR, SHIP, CRUISE) == '0005'
+    assert second.get_reservations(YEAR, SHIP, CRUISE) == {'0004': 'first', '0005': 'second'}
+
+
+def test_reserve_rejects_used_and_reserved_sernos(tmp_path, raw_directory):
+    touch_package(raw_directory, '0003')
+    first = create_ledger(tmp_path, raw_directory, 'first')
+    second = create_ledger(tmp_path, raw_directory, 'second')
+    first.reserve(YEAR, SHIP, CRUISE, serno='0007')
+
+    with pytest.raises(ValueError):
+        second.reserve(YEAR, SHIP, CRUISE, serno='0003')
+    with pytest.raises(ValueError):
+        second.reserve(YEAR, SHIP, CRUISE, serno='0007')
+    first.release(YEAR, SHIP, CRUISE)
+    assert second.reserve(YEAR, SHIP, CRUISE, serno='0007') == '0007'
+
+
+def test_reservation_is_dropped_when_package_is_written(tmp_path, raw_directory):
+    first = create_ledger(tmp_path, raw_directory, 'first')
+    second = create_ledger(tmp_path, raw_directory, 'second')
+    assert first.reserve(YEAR, SHIP, CRUISE) == '0001'
+
+    touch_package(raw_directory, '0001')
+    assert second.is_used(YEAR, SHIP, CRUISE, '0001')
+    assert first.get_reservations(YEAR, SHIP, CRUISE) == {}
+    assert first.next_serno(YEAR, SHIP, CRUISE) == '0002'
+
+
+def test_other_cruises_are_kept_apart(tmp_path, raw_directory):
+    touch_package(raw_directory, '0010', cruise='02')
+    ledger = create_ledger(tmp_path, raw_directory, 'first')
+    assert ledger.next_serno(YEAR, SHIP, CRUISE) == '0001'
+    assert ledger.next_serno(YEAR, SHIP, '02') == '0011'
+
+
+def test_reservation_expires(tmp_path, raw_directory):
+    first = create_ledger(tmp_path, raw_directory, 'first', reservation_ttl=0.2)
+    second = create_ledger(tmp_path, raw_directory, 'second', reservation_ttl=0.2)
+    assert first.reserve(YEAR, SHIP, CRUISE) == '0001'
+    assert second.next_serno(YEAR, SHIP, CRUISE) == '0002'
+    time.sleep(0.3)
+    assert second.reserve(YEAR, SHIP, CRUISE) == '0001'
+
+
+def test_reservation_of_ended_process_is_dropped(tmp_path, raw_directory):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=reserve_in_process, args=(tmp_path, raw_directory, None, queue))
+    process.start()
+    assert queue.get(timeout=10) == '0001'
+    process.join(10)
+
+    ledger = create_ledger(tmp_path, raw_directory, None)
+    assert ledger.get_reservations(YEAR, SHIP, CRUISE) == {}
+    assert ledger.reserve(YEAR, SHIP, CRUISE) == '0001'
+
+
+def test_processes_get_unique_sernos(tmp_path, raw_directory):
+    # Named owners keep their reservations after the processes have ended
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reserve_in_process,
+                                         args=(tmp_path, raw_directory, f'owner_{i}', queue))
+                 for i in range(8)]
+    for process in processes:
+        process.start()
+    sernos = [queue.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join(10)
+    assert sorted(sernos) == [str(serno).zfill(4) for serno in range(1, 9)]
+
+
+def test_file_lock_times_out(tmp_path):
+    path = Path(tmp_path, 'ledger.lock')
+    with FileLock(path):
+        with pytest.raises(TimeoutError):
+            FileLock(path, timeout=0.1).acquire()
+    with FileLock(path, timeout=0.1):
+        pass
+
+
+def test_file_lock_is_exclusive_between_threads(tmp_path):
+    path = Path(tmp_path, 'counter')
+    path.write_text('0')
+
+    def increment():
+        for _ in range(20):
+            with FileLock(Path(tmp_path, 'counter.lock')):
+                value = int(path.read_text())
+                time.sleep(0.001)
+                path.write_text(str(value + 1))
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert path.read_text() == '80'
+
+
+class LocalPaths:
+    """Local directories below root and no server root, as before the server root has been set."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.config_dir = None
+        self.source_dir = None
+
+    def __call__(self, key):
+        return getattr(self, key)
+
+    def set_config_root_directory(self, directory):
+        self.config_dir = Path(directory)
+
+    def set_source_directory(self, directory):
+        self.source_dir = Path(directory)
+
+    def get_local_directory(self, key, year=None, create=False, **kwargs):
+        if key == 'source':
+            return self.source_dir
+        directory = Path(self.root, key, str(year)) if year else Path(self.root, key)
+        if create:
+            directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def get_server_directory(self, key, year=None, **kwargs):
+        if key == 'root':
+            return None
+        raise NotADirectoryError('No server root directory set')
+
+
+@pytest.fixture
+def controller(tmp_path):
+    controller = Controller(LocalPaths(tmp_path), update_primary_station_list=False)
+    yield controller
+    controller.close()
+
+
+def test_controller_ledger_without_server_root(controller):
+    ledger = controller._get_serno_ledger(YEAR)
+    assert ledger.server_directories == []
+    assert controller.reserve_serno(year=YEAR, ship=SHIP, cruise=CRUISE) == '0001'
+
+
+def test_failed_psa_update_releases_reserved_serno(tmp_path, controller):
+    psa_path = Path(tmp_path, 'ctd_config', 'SBE', 'seasave_psa', 'svea', 'Seasave.psa')
+    psa_path.parent.mkdir(parents=True)
+    psa_path.touch()
+    controller.ctd_config_root_directory = Path(tmp_path, 'ctd_config')
+    # No instrument: get_data_file_path raises after the serno has been reserved
+    with pytest.raises(ValueError):
+        controller.update_main_psa_file(cruise_nr=CRUISE, ship_code=SHIP, serno='0005', year=YEAR)
+    assert controller._get_serno_ledger(YEAR).get_reservations(YEAR, SHIP, CRUISE) == {}
+
+
+def test_controller_ledger_checks_source_directory_set_later(tmp_path, controller):
+    assert controller.get_next_serno(year=YEAR, ship=SHIP, cruise=CRUISE) == '0001'
+    source_directory = Path(tmp_path, 'source')
+    touch_package(source_directory, '0005')
+    controller.ctd_data_directory = source_directory
+
+    assert controller.get_next_serno(year=YEAR, ship=SHIP, cruise=CRUISE) == '0006'
+    with pytest.raises(ValueError):
+        controller.reserve_serno(year=YEAR, ship=SHIP, cruise=CRUISE, serno='0005')
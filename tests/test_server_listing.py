@@ -0,0 +1,114 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from pre_system_svea.server_listing import ServerDirectoryScanner
+
+
+class SlowShare:
+    """Stand in for a network share: a local directory with injected latency."""
+
+    def __init__(self, directory, latency=0.):
+        self.directory = Path(directory)
+        self.latency = latency
+        self.mtime = time.time() - 60
+        self.listings = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_mtime(self, directory):
+        time.sleep(self.latency)
+        return self.mtime
+
+    def list_names(self, directory):
+        self.release.wait()
+        time.sleep(self.latency)
+        self.listings += 1
+        return frozenset(path.name for path in Path(directory).iterdir())
+
+    def add_file(self, name, change_mtime=True):
+        Path(self.directory, name).touch()
+        if change_mtime:
+            self.mtime = time.time()
+
+
+@pytest.fixture
+def share(tmp_path):
+    return SlowShare(tmp_path)
+
+
+def create_scanner(share, **kwargs):
+    return ServerDirectoryScanner(get_mtime=share.get_mtime, list_names=share.list_names, **kwargs)
+
+
+def test_listing_is_cached_for_ttl(share):
+    scanner = create_scanner(share, ttl=30.)
+    share.add_file('a.hex', change_mtime=False)
+    assert scanner.list_directory(share.directory).file_names == {'a.hex'}
+    share.add_file('b.hex', change_mtime=False)
+    assert scanner.list_directory(share.directory).file_names == {'a.hex'}
+    assert share.listings == 1
+    scanner.shutdown()
+
+
+def test_unchanged_mtime_is_not_listed_again(share):
+    scanner = create_scanner(share, ttl=0.)
+    scanner.list_directory(share.directory)
+    scanner.list_directory(share.directory)
+    assert share.listings == 1
+    share.add_file('a.hex')
+    assert scanner.list_directory(share.directory).file_names == {'a.hex'}
+    assert share.listings == 2
+    scanner.shutdown()
+
+
+def test_directory_changed_within_mtime_resolution_is_listed_again(share):
+    scanner = create_scanner(share, ttl=0.)
+    share.add_file('a.hex')
+    assert scanner.list_directory(share.directory).file_names == {'a.hex'}
+    # Added in the same mtime tick: the mtime stays the same
+    share.add_file('b.hex', change_mtime=False)
+    assert scanner.list_directory(share.directory).file_names == {'a.hex', 'b.hex'}
+    scanner.shutdown()
+
+
+def test_timeout_returns_stale_listing(share):
+    scanner = create_scanner(share, ttl=0., timeout=0.1)
+    share.add_file('a.hex')
+    assert scanner.list_directory(share.directory).file_names == {'a.hex'}
+
+    share.release.clear()
+    share.add_file('b.hex')
+    start = time.monotonic()
+    listing = scanner.list_directory(share.directory)
+    assert time.monotonic() - start < 0.5
+    assert listing.stale
+    assert isinstance(listing.error, TimeoutError)
+    assert listing.file_names == {'a.hex'}
+
+    # The pending scan updates the cache when the share answers
+    share.release.set()
+    time.sleep(0.2)
+    listing = scanner.list_directory(share.directory, max_age=30.)
+    assert not listing.stale
+    assert listing.file_names == {'a.hex', 'b.hex'}
+    scanner.shutdown()
+
+
+def test_first_listing_on_timeout_is_empty_and_stale(share):
+    share.latency = 0.3
+    scanner = create_scanner(share, timeout=0.05)
+    listing = scanner.list_directory(share.directory)
+    assert listing.stale and listing.listed_time is None
+    assert listing.file_names == frozenset()
+    scanner.shutdown()
+
+
+def test_missing_directory_gives_stale_listing(tmp_path):
+    scanner = ServerDirectoryScanner(timeout=1.)
+    listing = scanner.list_directory(Path(tmp_path, 'missing'))
+    assert listing.stale
+    assert isinstance(listing.error, OSError)
+    scanner.shutdown()
@@ -0,0 +1,37 @@
+import math
+
+import numpy as np
+import pytest
+
+from pre_system_svea.station_index import StationIndex
+
+LAT = [5515.0, 5520.0, 5700.0]
+LON = [1559.0, 1550.0, 1100.0]
+
+
+@pytest.fixture
+def index():
+    return StationIndex(LAT, LON, radius=[1000., 1000., 1000.])
+
+
+def test_nearest(index):
+    assert index.nearest(5515.0, 1559.0) == (0, 0)
+    assert index.nearest(5659.0, 1100.0)[0] == 2
+
+
+@pytest.mark.parametrize('lat, lon', [(math.nan, 1100.), (5515.0, math.nan), ('', 1100.)])
+def test_nearest_rejects_invalid_position(index, lat, lon):
+    with pytest.raises(ValueError):
+        index.nearest(lat, lon)
+
+
+def test_nearest_many_marks_invalid_positions(index):
+    indices, distances = index.nearest_many([5515.0, math.nan], [1559.0, 1100.])
+    assert list(indices) == [0, -1]
+    assert distances[0] == 0 and np.isnan(distances[1])
+
+
+def test_queries_with_invalid_position_find_nothing(index):
+    assert len(index.nearest_k(math.nan, 1100., 2)[0]) == 0
+    assert len(index.within(math.nan, 1100., 1e6)[0]) == 0
+    assert len(index.covering(math.nan, 1100.)[0]) == 0
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from pre_system_svea.svepa_info import SvepaInfoService, is_connection_error
+
+INFO = dict(station='BY5 BORNHOLMSDJ', lat='5515.0', lon='1559.0')
+
+
+class OperationalError(Exception):
+    """Named as the database driver errors raised when the database can not be reached"""
+
+
+class FakeSvepa:
+    def __init__(self):
+        self.result = INFO
+        self.calls = 0
+        self.called = threading.Event()
+
+    def get_current_station_info(self, path_to_svepa_credentials=None):
+        self.calls += 1
+        self.called.set()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return dict(self.result)
+
+
+@pytest.fixture
+def svepa():
+    return FakeSvepa()
+
+
+@pytest.fixture
+def service(svepa):
+    service = SvepaInfoService('credentials.yaml', interval=0.05, max_age=0.2, max_backoff=0.05,
+                               svepa_module=svepa)
+    yield service
+    service.stop(timeout=1)
+
+
+def test_is_connection_error():
+    assert is_connection_error(ConnectionRefusedError())
+    assert is_connection_error(TimeoutError())
+    assert is_connection_error(OperationalError('server not found'))
+    assert not is_connection_error(KeyError('station'))
+    assert not is_connection_error(FileNotFoundError('credentials.yaml'))
+
+
+def test_get_info_waits_for_first_answer(service):
+    assert service.get_info(wait=1) == INFO
+
+
+def test_unreachable_svepa_raises_connection_error(service, svepa):
+    svepa.result = ConnectionRefusedError('no route to host')
+    with pytest.raises(ConnectionError) as exc_info:
+        service.get_info(wait=1)
+    assert exc_info.value.__cause__ is svepa.result
+
+
+def test_other_errors_are_raised_as_they_are(service, svepa):
+    assert service.get_info(wait=1) == INFO
+    svepa.result = KeyError('station')
+    service.refresh()
+    time.sleep(0.1)
+    with pytest.raises(KeyError):
+        service.get_info(wait=1)
+    with pytest.raises(KeyError):
+        service.get_info(wait=1, allow_stale=True)
+
+
+def test_stale_info_is_refreshed(service, svepa):
+    assert service.get_info(wait=1) == INFO
+    service.stop(timeout=1)
+    time.sleep(0.25)
+    assert service.get_snapshot().stale
+    svepa.result = dict(INFO, station='BY4 CHRISTIANSÖ')
+    assert service.get_info(wait=1)['station'] == 'BY4 CHRISTIANSÖ'
+
+
+def test_stale_info_raises_unless_allowed(service, svepa):
+    assert service.get_info(wait=1) == INFO
+    svepa.result = OperationalError('server not found')
+    time.sleep(0.3)
+    assert service.get_snapshot().stale
+    with pytest.raises(ConnectionError):
+        service.get_info(wait=1)
+    assert service.get_info(wait=1, allow_stale=True) == INFO
+
+
+def test_callers_do_not_wait_during_backoff(svepa):
+    def slow_failure(path_to_svepa_credentials=None):
+        svepa.calls += 1
+        time.sleep(0.3)
+        raise ConnectionRefusedError('no route to host')
+
+    svepa.get_current_station_info = slow_failure
+    service = SvepaInfoService('credentials.yaml', interval=0.05, max_age=0.2, max_backoff=30., svepa_module=svepa)
+    try:
+        with pytest.raises(ConnectionError):
+            service.get_info(wait=1)
+        time.sleep(0.5)
+        calls = svepa.calls
+        for _ in range(5):
+            start = time.monotonic()
+            with pytest.raises(ConnectionError):
+                service.get_info(wait=1)
+            assert time.monotonic() - start < 0.1
+        assert svepa.calls == calls
+    finally:
+        service.stop(timeout=1)